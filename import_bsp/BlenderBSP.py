@@ -18,7 +18,7 @@
 
 import bpy
 
-from .idtech3lib.ID3VFS import Q3VFS
+from .idtech3lib.ID3VFS import get_vfs_session
 from .idtech3lib.BSP import BSP_READER as BSP
 from .idtech3lib import GamePacks, MAP
 from math import atan, radians
@@ -630,13 +630,31 @@ def sort_bsp_objects_into_collections(main_collection):
             ent_collection.objects.link(obj)
 
 
+def run_traced(VFS, import_settings, import_function):
+    # optionally records every vfs access of one import
+    trace_file = import_settings.vfs_trace_file
+    if not trace_file:
+        return import_function(VFS, import_settings)
+    VFS.start_trace()
+    try:
+        return import_function(VFS, import_settings)
+    finally:
+        trace = VFS.stop_trace()
+        VFS.print_trace_summary(trace)
+        try:
+            VFS.write_trace(trace_file, trace)
+        except Exception as e:
+            print("Could not write vfs trace", trace_file, e)
+
+
 def import_bsp_file(import_settings):
 
     print("initialize virtual file system")
-    VFS = Q3VFS()
-    for base_path in import_settings.base_paths:
-        VFS.add_base(base_path)
-    VFS.build_index()
+    VFS = get_vfs_session(import_settings.base_paths)
+    return run_traced(VFS, import_settings, import_bsp)
+
+
+def import_bsp(VFS, import_settings):
 
     print("read bsp data")
     bsp_file = BSP(VFS, import_settings)
@@ -820,10 +838,11 @@ def import_bsp_file(import_settings):
 def import_map_file(import_settings):
 
     # initialize virtual file system
-    VFS = Q3VFS()
-    for base_path in import_settings.base_paths:
-        VFS.add_base(base_path)
-    VFS.build_index()
+    VFS = get_vfs_session(import_settings.base_paths)
+    return run_traced(VFS, import_settings, import_map)
+
+
+def import_map(VFS, import_settings):
 
     byte_array = VFS.get(import_settings.file)
 
@@ -17,48 +17,96 @@ def remove_file_extension(file_path):
     return file_path
 
 
+# image path -> name of the packed image, blender appends a suffix to
+# the name when several textures share a file name
+packed_images = {}
+
+
+def get_packed_image(image_path):
+    for name in (packed_images.get(image_path),
+                 os.path.basename(image_path)):
+        if name is None:
+            continue
+        image = bpy.data.images.get(name)
+        if (image is not None and
+                image.filepath_raw == image_path and
+                image.packed_file):
+            return image
+    return None
+
+
+def load_from_bytes(image_path, byte_array, stamp=None):
+    # packs the file contents directly, blender decodes them from memory
+    # stamp identifies the version of the file the bytes are from
+    image = get_packed_image(image_path)
+    if image is not None and image.get("vfs_stamp") == stamp:
+        return image
+    new_image = bpy.data.images.new(os.path.basename(image_path), 8, 8)
+    new_image.filepath_raw = image_path
+    new_image.pack(data=bytes(byte_array), data_len=len(byte_array))
+    new_image.source = 'FILE'
+    if stamp is not None:
+        new_image["vfs_stamp"] = stamp
+    if image is not None:
+        # the file changed since it was packed, swap in the new version
+        name = image.name
+        image.user_remap(new_image)
+        bpy.data.images.remove(image)
+        new_image.name = name
+    packed_images[image_path] = new_image.name
+    return new_image
+
+
 def load_file(file_path, VFS):
     file_path_without_ext = remove_file_extension(file_path)
-    if VFS is not None:
-        file_paths = [basepath + file_path_without_ext for basepath in VFS.basepaths]
-        file_paths.append(bpy.app.tempdir + file_path_without_ext)
-    else:
-        file_paths = [file_path_without_ext]
-
-    #try loading images directly
-    for fp in file_paths:
+    if VFS is None:
         for extension in extensions:
             try:
                 return bpy.data.images.load(
-                    fp + extension, check_existing=True)
+                    file_path_without_ext + extension, check_existing=True)
             except Exception:
                 continue
+        print("Couldn't load texture: ", file_path)
+        return None
 
-    # try loading image from vfs instead
-    for extension in extensions:
-        try:
-            image_bytearray = VFS.get(file_path_without_ext + extension)
-            if image_bytearray is None:
-                continue
-            temp_filename = bpy.app.tempdir + file_path_without_ext + extension
+    # one index lookup for all extensions, misses are remembered
+    image_path = VFS.resolve(file_path_without_ext, extensions)
 
-            os.makedirs(os.path.dirname(temp_filename), exist_ok=True)
+    # existing images are loaded again when the file changed since
+    if image_path is not None:
+        stamp = repr(VFS.get_stamp(image_path))
 
-            temp_file = open(temp_filename, "wb")
-            temp_file.write(image_bytearray)
-            temp_file.close()
+    # try loading loose images directly
+    if image_path is not None:
+        local_path = VFS.get_local_path(image_path)
+        if local_path is not None:
+            try:
+                image = bpy.data.images.load(local_path, check_existing=True)
+                if image.get("vfs_stamp", stamp) != stamp:
+                    image.reload()
+                image["vfs_stamp"] = stamp
+                return image
+            except Exception:
+                pass
 
-            b_image = bpy.data.images.load(
-                temp_filename, check_existing=True)
-            b_image.pack()
-            return b_image
+    # try loading image from vfs instead
+    if image_path is not None:
+        try:
+            extension = image_path[len(file_path_without_ext):]
+            packed_path = bpy.app.tempdir + file_path_without_ext + extension
+            image = get_packed_image(packed_path)
+            if image is not None and image.get("vfs_stamp") == stamp:
+                return image
+            image_bytearray = VFS.get(image_path, cache=False)
+            return load_from_bytes(packed_path, image_bytearray, stamp)
         except Exception:
-            continue
+            pass
 
     # try loading ftx image
     try:
-        image_bytearray = VFS.get(file_path_without_ext + ".ftx")
-        if image_bytearray is not None:
+        ftx_path = VFS.resolve(file_path_without_ext, (".ftx",))
+        if ftx_path is not None:
+            image_bytearray = VFS.get(ftx_path, cache=False)
             image = loadFtx_from_bytearray(file_path_without_ext, image_bytearray)
             new_image = bpy.data.images.new(
                 image.name,
@@ -74,20 +122,13 @@ def load_file(file_path, VFS):
 
     # try loading DDS folder dds files
     try:
-        image_bytearray = VFS.get("DDS/" + file_path_without_ext + ".dds")
-        if image_bytearray is not None:
-            temp_filename = bpy.app.tempdir + "DDS/" + file_path_without_ext + extension
-
-            os.makedirs(os.path.dirname(temp_filename), exist_ok=True)
-
-            temp_file = open(temp_filename, "wb")
-            temp_file.write(image_bytearray)
-            temp_file.close()
-
-            b_image = bpy.data.images.load(
-                temp_filename, check_existing=True)
-            b_image.pack()
-            return b_image
+        dds_path = VFS.resolve("DDS/" + file_path_without_ext, (".dds",))
+        if dds_path is not None:
+            image_bytearray = VFS.get(dds_path, cache=False)
+            return load_from_bytes(
+                bpy.app.tempdir + "DDS/" + file_path_without_ext + ".dds",
+                image_bytearray,
+                repr(VFS.get_stamp(dds_path)))
     except Exception:
         pass
 
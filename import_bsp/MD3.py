@@ -437,7 +437,10 @@ def ImportMD3(VFS,
         byte_array = bytearray(file.read())
         file.close()
     else:
-        byte_array = VFS.get(model_name)
+        model_path = VFS.resolve(model_name)
+        if model_path is None:
+            return [mesh]
+        byte_array = VFS.get(model_path)
         if not byte_array:
             return [mesh]
 
@@ -2,7 +2,9 @@ import bpy
 import os
 import struct
 from mathutils import Vector
-from math import floor, ceil, pi, pow, atan2, sqrt, acos, isnan
+from math import floor, pi, pow, atan2, sqrt, acos, isnan
+from itertools import product
+from numpy import array, indices, ones
 from . import GridIcoSphere
 
 
@@ -717,41 +719,22 @@ def storeLightgrid(bsp, light_settings):
         lightgrid_dimensions[2])
 
     # get all lightgrid points that are in the void
+    # a cell is only void when its center and all of its corners are
+    # in solid leafs
+    grid_z, grid_y, grid_x = indices((
+        int(lightgrid_dimensions[2]),
+        int(lightgrid_dimensions[1]),
+        int(lightgrid_dimensions[0]))).reshape(3, -1)
+    grid_size = array(lightgrid_size)
+    cell_points = (array((grid_x, grid_y, grid_z)).T * grid_size +
+                   array(lightgrid_origin))
+    void_cells = ones(len(cell_points), dtype=bool)
+    for offset in [(0.0, 0.0, 0.0)] + list(product((-0.5, 0.5), repeat=3)):
+        leafs, clusters, areas = bsp.find_leaves(
+            cell_points + array(offset) * grid_size)
+        void_cells &= areas == -1
     void_pixels = [True for i in range(num_elements_lightgrid)]
-    for index, leaf in enumerate(bsp.lumps["leafs"]):
-        if leaf.area == -1:
-            continue
-
-        start = [-lightgrid_origin[0], -
-                 lightgrid_origin[1], -lightgrid_origin[2]]
-        start[0] += leaf.mins[0]
-        start[1] += leaf.mins[1]
-        start[2] += leaf.mins[2]
-        start[0] = floor(start[0] / lightgrid_size[0])
-        start[1] = floor(start[1] / lightgrid_size[1])
-        start[2] = floor(start[2] / lightgrid_size[2])
-        steps = [leaf.maxs[0]-leaf.mins[0], leaf.maxs[1] -
-                 leaf.mins[1], leaf.maxs[2]-leaf.mins[2]]
-        steps[0] = int(ceil(steps[0] / lightgrid_size[0]))+1
-        steps[1] = int(ceil(steps[1] / lightgrid_size[1]))+1
-        steps[2] = int(ceil(steps[2] / lightgrid_size[2]))+1
-
-        for z in range(steps[2]):
-            for y in range(steps[1]):
-                for x in range(steps[0]):
-                    min_x = x+start[0]
-                    min_y = y+start[1]
-                    min_z = z+start[2]
-                    if min_x >= 0 and min_y >= 0 and min_z >= 0:
-                        id = min_z * \
-                            lightgrid_dimensions[0]*lightgrid_dimensions[1]
-                        id += min_y*lightgrid_dimensions[0]
-                        id += min_x
-                        id = int(id)
-                        if id < 0 or id >= num_elements_lightgrid:
-                            continue
-
-                        void_pixels[id] = False
+    void_pixels[:len(void_cells)] = void_cells.tolist()
 
     if bsp.use_lightgridarray:
         num_elements = 65535
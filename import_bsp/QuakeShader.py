@@ -1617,7 +1617,36 @@ def create_white_image():
     new_image.use_fake_user = True
 
 
-def build_quake_shaders(VFS, import_settings, object_list):
+def add_shader_vertex_groups(object_list, material_name, polygon_offset,
+                             external_lightmap):
+    # polygon offset to vertex group
+    if not polygon_offset and not external_lightmap:
+        return
+    for obj in object_list:
+        for index, m in enumerate(obj.material_slots):
+            if m.name == material_name:
+                verts = [v for f in obj.data.polygons
+                         if f.material_index == index
+                         for v in f.vertices]
+                if len(verts):
+                    if polygon_offset:
+                        vg = obj.vertex_groups.get(
+                            "Decals")
+                        if vg is None:
+                            vg = obj.vertex_groups.new(
+                                name="Decals")
+                        vg.add(verts, 1.0, 'ADD')
+                    if external_lightmap:
+                        vg = obj.vertex_groups.get(
+                            "ExternalLightmap")
+                        if vg is None:
+                            vg = obj.vertex_groups.new(
+                                name="ExternalLightmap")
+                        vg.add(verts, 1.0, 'ADD')
+                break
+
+
+def build_quake_shaders(VFS, import_settings, object_list, only_changed=False):
 
     # make sure the $whiteimage is loaded
     create_white_image()
@@ -1650,6 +1679,7 @@ def build_quake_shaders(VFS, import_settings, object_list):
         if mod is not None:
             object.modifiers.remove(mod)
 
+    material_shaders = {}
     for m in material_list:
         index = m[0].material.name.find('.')
         if not (index == -1):
@@ -1657,21 +1687,38 @@ def build_quake_shaders(VFS, import_settings, object_list):
             shader_name = split_name[0]
         else:
             shader_name = m[0].material.name
-
-        qs = quake_shader(m[0].material.name, m[0].material)
-        if m[1]:
-            qs.set_vertex_lit()
-        if m[2]:
-            qs.set_grid_lit()
-
-        if shader_name in shaders:
-            shaders[l_format(shader_name)].append(qs)
-        else:
-            shaders.setdefault(l_format(shader_name), []).append(qs)
+        material_shaders.setdefault(l_format(shader_name), []).append(m)
 
     shader_info = ID3Shader.get_material_dicts(VFS,
                                                import_settings,
-                                               shaders.keys())
+                                               material_shaders.keys())
+
+    # materials that are up to date, only their vertex groups are restored
+    skipped_materials = []
+    for shader_name, materials in material_shaders.items():
+        attributes, stages = shader_info.get(shader_name, ({}, []))
+        for m in materials:
+            build_key = ID3Shader.get_shader_build_key(
+                VFS,
+                shader_name,
+                attributes,
+                stages,
+                (import_settings.preset,
+                 import_settings.normal_map_option,
+                 m[1],
+                 m[2]))
+            material = m[0].material
+            if only_changed and material.get("build_key") == build_key:
+                skipped_materials.append((material, attributes))
+                continue
+
+            qs = quake_shader(material.name, material)
+            if m[1]:
+                qs.set_vertex_lit()
+            if m[2]:
+                qs.set_grid_lit()
+            material["build_key"] = build_key
+            shaders.setdefault(shader_name, []).append(qs)
 
     for shader in shaders:
         current_shaders = shaders[shader]
@@ -1708,30 +1755,22 @@ def build_quake_shaders(VFS, import_settings, object_list):
                 if (shader_stage.tcGen == TCGEN_LM and
                    shader_stage.diffuse.startswith("maps/")):
                     has_external_lm = True
-            # polygon offset to vertex group
-            if "polygonoffset" in attributes or has_external_lm:
-                for obj in object_list:
-                    for index, m in enumerate(obj.material_slots):
-                        if m.name == current_shader.name:
-                            verts = [v for f in obj.data.polygons
-                                     if f.material_index == index
-                                     for v in f.vertices]
-                            if len(verts):
-                                if "polygonoffset" in attributes:
-                                    vg = obj.vertex_groups.get(
-                                        "Decals")
-                                    if vg is None:
-                                        vg = obj.vertex_groups.new(
-                                            name="Decals")
-                                    vg.add(verts, 1.0, 'ADD')
-                                if has_external_lm:
-                                    vg = obj.vertex_groups.get(
-                                        "ExternalLightmap")
-                                    if vg is None:
-                                        vg = obj.vertex_groups.new(
-                                            name="ExternalLightmap")
-                                    vg.add(verts, 1.0, 'ADD')
-                            break
+            if current_shader.mat is not None:
+                current_shader.mat["external_lightmap"] = has_external_lm
+            add_shader_vertex_groups(object_list,
+                                     current_shader.name,
+                                     "polygonoffset" in attributes,
+                                     has_external_lm)
+
+    for material, attributes in skipped_materials:
+        if "first_line" in attributes:
+            material["first_line"] = attributes["first_line"]
+        if "shader_file" in attributes:
+            material["shader_file"] = attributes["shader_file"]
+        add_shader_vertex_groups(object_list,
+                                 material.name,
+                                 "polygonoffset" in attributes,
+                                 material.get("external_lightmap", False))
     for shader in shaders:
         if shader in shader_info:
             continue
@@ -673,7 +673,10 @@ def ImportTAN(VFS,
         byte_array = bytearray(file.read())
         file.close()
     else:
-        byte_array = VFS.get(model_name)
+        model_path = VFS.resolve(model_name)
+        if model_path is None:
+            return [mesh]
+        byte_array = VFS.get(model_path)
         if not byte_array:
             return [mesh]
 
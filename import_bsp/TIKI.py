@@ -12,10 +12,11 @@ def load_tiki(VFS, file_name, current_info = None):
         current_info["no_draw"] = []
         current_info["replacement"] = {}
 
-    byte_array = VFS.get(file_name)
-    if byte_array is None:
+    file_path = VFS.resolve(file_name)
+    if file_path is None:
         print("Could not open file", file_name)
         return current_info
+    byte_array = VFS.get(file_path)
     
     is_open = 0
     for line in byte_array.decode().splitlines():
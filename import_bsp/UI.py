@@ -18,7 +18,8 @@ from . import MD3, TAN, TIKI, MDR
 from . import QuakeShader, QuakeSky, QuakeLight, ShaderNodes
 
 from .idtech3lib import Helpers, Parsing, GamePacks
-from .idtech3lib.ID3VFS import Q3VFS
+from .idtech3lib import ID3VFS
+from .idtech3lib.ID3VFS import get_vfs_session
 from .idtech3lib.ImportSettings import *
 
 
@@ -164,8 +165,12 @@ class Import_ID3_BSP(bpy.types.Operator, ImportHelper):
             entity_dict=entity_dict,
             vert_lit_handling=stupid_dict[self.vert_map_packing],
             normal_map_option=prefs.normal_map_option,
-            surface_info_storing=Surface_info_storing.PER_TRIANGLE
+            surface_info_storing=Surface_info_storing.PER_TRIANGLE,
+            vfs_trace_file=bpy.path.abspath(prefs.vfs_trace_file)
         )
+        if prefs.bsp_cache and ID3VFS.index_cache_dir:
+            import_settings.bsp_cache_dir = os.path.join(
+                ID3VFS.index_cache_dir, "bsp")
 
         # scene information
         context.scene.id_tech_3_importer_preset = self.preset
@@ -238,6 +243,8 @@ class Import_MAP(bpy.types.Operator, ImportHelper):
         default=False)
 
     def execute(self, context):
+        addon_name = __name__.split('.')[0]
+        prefs = context.preferences.addons[addon_name].preferences
         entity_dict = get_current_entity_dict(context)
 
         import_preset = Preset.ONLY_LIGHTS.value if self.only_lights else Preset.EDITING.value
@@ -251,7 +258,8 @@ class Import_MAP(bpy.types.Operator, ImportHelper):
             front_culling=False,
             surface_types=Surface_Type.BAD, # not used
             entity_dict=entity_dict,
-            normal_map_option=NormalMapOption.SKIP.value
+            normal_map_option=NormalMapOption.SKIP.value,
+            vfs_trace_file=bpy.path.abspath(prefs.vfs_trace_file)
         )
 
         BlenderBSP.import_map_file(import_settings)
@@ -298,10 +306,7 @@ class Import_ID3_MD3(bpy.types.Operator, ImportHelper):
         import_settings.normal_map_option = NormalMapOption.SKIP.value
 
         # initialize virtual file system
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         objs = MD3.ImportMD3Object(
             VFS,
@@ -391,10 +396,7 @@ class Import_ID3_MDR(bpy.types.Operator, ImportHelper):
         import_settings.normal_map_option = NormalMapOption.SKIP.value
 
         # initialize virtual file system
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         objs = MDR.ImportMDR(
             VFS,
@@ -447,10 +449,7 @@ class Import_ID3_TIK(bpy.types.Operator, ImportHelper):
         import_settings.normal_map_option = NormalMapOption.SKIP.value
 
         # initialize virtual file system
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         objs = TIKI.ImportTIKObject(
             VFS,
@@ -1077,10 +1076,7 @@ def update_model(self, context):
         import_settings.shader_dirs = "shaders/", "scripts/"
         import_settings.preset = 'PREVIEW'
 
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         mesh = MD3.ImportMD3(VFS, mesh_name + ".md3", zoffset)[0]
         if mesh is not None:
@@ -1146,10 +1142,7 @@ def update_model2(self, context):
         import_settings.shader_dirs = "shaders/", "scripts/"
         import_settings.preset = 'PREVIEW'
 
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         mesh = MD3.ImportMD3(VFS, mesh_name + ".md3", zoffset)[0]
         if mesh is not None:
@@ -1526,10 +1519,7 @@ class PatchBspEntities(bpy.types.Operator, ExportHelper):
             base_paths=get_base_paths(context)
         )
 
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         bsp = BlenderBSP.get_bsp_file(VFS, import_settings)
    
@@ -1538,19 +1528,15 @@ class PatchBspEntities(bpy.types.Operator, ExportHelper):
         bsp.set_entity_lump(entities)
 
         # write bsp
-        bsp_bytes = bsp.to_bytes()
-
         name = self.filepath
         if self.create_backup is True:
             name = name.replace(".bsp", "") + "_ent_patched.bsp"
 
-        f = open(name, "wb")
         try:
-            f.write(bsp_bytes)
+            bsp.write_file(name)
         except Exception:
             print("Failed writing: " + name)
 
-        f.close()
         return {'FINISHED'}
 
 
@@ -1642,10 +1628,7 @@ class PatchBspData(bpy.types.Operator, ExportHelper):
             entity_dict=entity_dict
         )
 
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         bsp = BlenderBSP.get_bsp_file(VFS, import_settings)
 
@@ -2096,19 +2079,15 @@ class PatchBspData(bpy.types.Operator, ExportHelper):
             self.report({"INFO"} if success else {"ERROR"}, message)
 
         # write bsp
-        bsp_bytes = bsp.to_bytes()
-
         name = self.filepath
         if self.create_backup is True:
             name = name.replace(".bsp", "") + "_data_patched.bsp"
 
-        f = open(name, "wb")
         try:
-            f.write(bsp_bytes)
+            bsp.write_file(name)
         except Exception:
             self.report({"ERROR"}, "Failed writing: " + name)
             return {'CANCELLED'}
-        f.close()
 
         return {'FINISHED'}
 
@@ -2396,6 +2375,12 @@ class Reload_preview_shader(bpy.types.Operator):
     bl_label = "Reload Eevee Shaders"
     bl_options = {'REGISTER', 'UNDO'}
 
+    only_changed: BoolProperty(
+        name="Only changed shaders",
+        description="Only rebuilds materials whose shader text or "
+        "images changed since they were built",
+        default=True)
+
     def execute(self, context):
         addon_name = __name__.split('.')[0]
         prefs = context.preferences.addons[addon_name].preferences
@@ -2406,13 +2391,11 @@ class Reload_preview_shader(bpy.types.Operator):
         )
 
         # initialize virtual file system
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         objs = [obj for obj in context.selected_objects if obj.type == "MESH"]
-        QuakeShader.build_quake_shaders(VFS, import_settings, objs)
+        QuakeShader.build_quake_shaders(
+            VFS, import_settings, objs, self.only_changed)
 
         return {'FINISHED'}
 
@@ -2423,6 +2406,12 @@ class Reload_render_shader(bpy.types.Operator):
     bl_label = "Reload Cycles Shaders"
     bl_options = {'REGISTER', 'UNDO'}
 
+    only_changed: BoolProperty(
+        name="Only changed shaders",
+        description="Only rebuilds materials whose shader text or "
+        "images changed since they were built",
+        default=True)
+
     def execute(self, context):
         addon_name = __name__.split('.')[0]
         prefs = context.preferences.addons[addon_name].preferences
@@ -2433,13 +2422,11 @@ class Reload_render_shader(bpy.types.Operator):
         )
 
         # initialize virtual file system
-        VFS = Q3VFS()
-        for base_path in import_settings.base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(import_settings.base_paths)
 
         objs = [obj for obj in context.selected_objects if obj.type == "MESH"]
-        QuakeShader.build_quake_shaders(VFS, import_settings, objs)
+        QuakeShader.build_quake_shaders(
+            VFS, import_settings, objs, self.only_changed)
 
         return {'FINISHED'}
 
@@ -2464,13 +2451,9 @@ class FillAssetLibrary(bpy.types.Operator):
             self.report({"ERROR"}, "No base path configured.")
             return {'CANCELLED'}
         # initialize virtual file system
-        VFS = Q3VFS()
-        for base_path in base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(base_paths)
 
-        reg = r"(.*?).md3$"
-        md3_files = VFS.search(reg)
+        md3_files = VFS.list_dir(ext=".md3", recursive=True)
         md3_files = [f[1:] if f.startswith("/") else f for f in md3_files]
 
         cats_f = "{}/blender_assets.cats.txt".format(asset_library_path)
@@ -2616,10 +2599,7 @@ class FillAssetLibraryEntities(bpy.types.Operator):
             return {'CANCELLED'}
         
         # initialize virtual file system
-        VFS = Q3VFS()
-        for base_path in base_paths:
-            VFS.add_base(base_path)
-        VFS.build_index()
+        VFS = get_vfs_session(base_paths)
 
         cats_f = "{}/blender_assets.cats.txt".format(asset_library_path)
         os.makedirs(asset_library_path, exist_ok=True)
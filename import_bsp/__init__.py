@@ -86,6 +86,16 @@ def update_panels(self, context):
     return True
 
 
+def update_base_paths(self, context):
+    # the shared vfs indexes were built for the old paths
+    idtech3lib.ID3VFS.invalidate_vfs_sessions()
+
+
+def update_vfs_cache_size(self, context):
+    idtech3lib.ID3VFS.set_content_cache_budget(
+        self.vfs_cache_size * 1024 * 1024)
+
+
 # ------------------------------------------------------------------------
 #    store properties in the user preferences
 # ------------------------------------------------------------------------
@@ -97,6 +107,7 @@ class BspImportAddonPreferences(bpy.types.AddonPreferences):
         default="",
         subtype="DIR_PATH",
         maxlen=2048,
+        update=update_base_paths,
     )
 
     mod_path_0: bpy.props.StringProperty(
@@ -105,6 +116,7 @@ class BspImportAddonPreferences(bpy.types.AddonPreferences):
         default="",
         subtype="DIR_PATH",
         maxlen=2048,
+        update=update_base_paths,
     )
 
     mod_path_1: bpy.props.StringProperty(
@@ -113,6 +125,7 @@ class BspImportAddonPreferences(bpy.types.AddonPreferences):
         default="",
         subtype="DIR_PATH",
         maxlen=2048,
+        update=update_base_paths,
     )
 
     merge_id3_panels: bpy.props.BoolProperty(
@@ -122,6 +135,33 @@ class BspImportAddonPreferences(bpy.types.AddonPreferences):
         update=update_panels
     )
 
+    bsp_cache: bpy.props.BoolProperty(
+        name="Cache BSP lightmap info",
+        description="Remembers the lightmap info of imported bsp files, "
+                    "so importing the same map again skips computing it",
+        default=False,
+    )
+
+    vfs_cache_size: bpy.props.IntProperty(
+        name="VFS cache size (MB)",
+        description="Memory for keeping file contents of every base path "
+                    "setup around, textures are not kept as blender "
+                    "packs them anyway",
+        default=32,
+        min=0,
+        update=update_vfs_cache_size,
+    )
+
+    vfs_trace_file: bpy.props.StringProperty(
+        name="VFS trace file",
+        description="Writes every file access of a bsp or map import to "
+                    "this json file and prints a summary, empty disables "
+                    "tracing",
+        default="",
+        subtype="FILE_PATH",
+        maxlen=2048,
+    )
+
     default_classname: bpy.props.StringProperty(
         name="Asset classname",
         description="classname that is assigned to the imported assets per default",
@@ -208,6 +248,12 @@ class BspImportAddonPreferences(bpy.types.AddonPreferences):
         row.prop(self, "normal_map_option")
         row = layout.row()
         row.prop(self, "merge_id3_panels")
+        row = layout.row()
+        row.prop(self, "bsp_cache")
+        row = layout.row()
+        row.prop(self, "vfs_cache_size")
+        row = layout.row()
+        row.prop(self, "vfs_trace_file")
         layout.separator()
         row = layout.row()
         row.prop(self, "gamepack")
@@ -328,6 +374,12 @@ def register():
         cls.bl_category = "ID3 Editing" if prefs.merge_id3_panels else catergory
         bpy.utils.register_class(cls)
 
+    # persist vfs indexes so unchanged pk3s are not read again
+    idtech3lib.ID3VFS.set_index_cache_dir(
+        bpy.utils.user_resource('CONFIG', path="import_bsp_cache"))
+    idtech3lib.ID3VFS.set_content_cache_budget(
+        prefs.vfs_cache_size * 1024 * 1024)
+
 
 def unregister():
     bpy.types.TOPBAR_MT_file_import.remove(UI.menu_func_map_import)
@@ -352,6 +404,8 @@ def unregister():
     for cls, catergory in panel_cls:
         bpy.utils.unregister_class(cls)
 
+    idtech3lib.ID3Shader.shutdown_shader_pool()
+
 
 if __name__ == "__main__":
     register()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from ctypes import LittleEndianStructure, c_char, c_int, sizeof
+from ctypes import Array, LittleEndianStructure, c_char, c_int, sizeof
 from .RBSP import BSP_INFO as RBSP
 from .IBSP import BSP_INFO as IBSP
 from .EF2BSP import BSP_INFO as EF2BSP
@@ -7,9 +7,19 @@ from .FBSP import BSP_INFO as FBSP
 from .ID3Model import ID3Model as MODEL
 from .ID3Object import ID3Object as OBJECT
 from .ID3Image import ID3Image as IMAGE
-from .ID3Shader import get_material_dicts
+from .ID3Shader import get_material_dicts, get_shader_files_key
+from collections.abc import Mapping, MutableMapping
+from hashlib import sha1
 from math import floor, ceil
+import json
+import mmap
+import os
+import shutil
+import tempfile
 from numpy import array, dot, sin, cos, sqrt, pi
+from numpy import dtype, frombuffer, ndarray, ones, zeros
+from numpy import arange, asarray, cumsum, flatnonzero, repeat, unique
+from numpy import einsum, float64, int32, intp, uint8, unpackbits
 from struct import unpack
 from typing import List, Tuple
 from .ImportSettings import Vert_lit_handling
@@ -54,26 +64,203 @@ class BSP_LUMP_HEADER(LittleEndianStructure):
     ]
 
 
+def lump_dtype(data_class) -> dtype:
+    # builds a numpy dtype with the exact memory layout of a ctypes type
+    if issubclass(data_class, Array):
+        if data_class._type_ is c_char:
+            return dtype("S" + str(data_class._length_))
+        return dtype((lump_dtype(data_class._type_), (data_class._length_,)))
+    if hasattr(data_class, "_fields_"):
+        names = []
+        formats = []
+        offsets = []
+        for name, field_class in data_class._fields_:
+            names.append(name)
+            formats.append(lump_dtype(field_class))
+            offsets.append(getattr(data_class, name).offset)
+        return dtype({"names": names,
+                      "formats": formats,
+                      "offsets": offsets,
+                      "itemsize": sizeof(data_class)})
+    if data_class is c_char:
+        return dtype("S1")
+    return dtype("<" + data_class._type_)
+
+
+def records_from_array(data_class, lump_array) -> list:
+    # one bulk copy, the records share the memory of a single ctypes array
+    if len(lump_array) == 0:
+        return []
+    records = (data_class * len(lump_array)).from_buffer_copy(lump_array)
+    return list(records)
+
+
 class BSP_LUMP_READER:
     def __init__(self, header, data_class):
         self.data_class = data_class
         self.class_size = sizeof(self.data_class)
+        self.dtype = lump_dtype(self.data_class)
         self.offset = header.offset
         self.size = header.size
-
-    def readFrom(self, bsp_bytearray) -> list:
-        data = []
-        count = int(self.size / self.class_size)
-        for i in range(count):
-            data.append(
-                self.data_class.from_buffer_copy(
-                    bsp_bytearray,
-                    self.offset + (i * self.class_size)))
-        return data
+        self.count = int(self.size / self.class_size)
+
+    def readArray(self, bsp_buffer) -> ndarray:
+        # zero-copy view of the lump inside the bsp buffer
+        if self.count <= 0:
+            return zeros(0, dtype=self.dtype)
+        return frombuffer(bsp_buffer,
+                          dtype=self.dtype,
+                          count=self.count,
+                          offset=self.offset)
+
+    def readFrom(self, bsp_buffer) -> list:
+        return records_from_array(self.data_class,
+                                  self.readArray(bsp_buffer))
+
+
+class BSP_LUMP_ARRAYS(Mapping):
+    def __init__(self, lumps):
+        self.lumps = lumps
+
+    def __getitem__(self, lump) -> ndarray:
+        return self.lumps.array(lump)
+
+    def __iter__(self):
+        return iter(self.lumps)
+
+    def __len__(self):
+        return len(self.lumps)
+
+
+class BSP_LUMPS(MutableMapping):
+    # decodes lumps on first access and remembers which ones were used
+    # blob lumps are handled as a single bytes object instead of records
+    def __init__(self, bsp_buffer, lump_readers, blob_lumps=()):
+        self.bsp_buffer = bsp_buffer
+        self.readers = lump_readers
+        self.blob_lumps = blob_lumps
+        self.records = {}
+        self.lump_arrays = {}
+        self.accessed = set()
+        self.arrays = BSP_LUMP_ARRAYS(self)
+
+    def __getitem__(self, lump) -> list:
+        if lump not in self.records:
+            if lump not in self.readers:
+                raise KeyError(lump)
+            if lump in self.blob_lumps:
+                self.records[lump] = self.array(lump).tobytes()
+            else:
+                self.records[lump] = records_from_array(
+                    self.readers[lump].data_class, self.array(lump))
+        self.accessed.add(lump)
+        return self.records[lump]
+
+    def __setitem__(self, lump, value):
+        self.accessed.add(lump)
+        self.records[lump] = value
+
+    def __delitem__(self, lump):
+        if lump not in self:
+            raise KeyError(lump)
+        self.readers.pop(lump, None)
+        self.records.pop(lump, None)
+        self.lump_arrays.pop(lump, None)
+
+    def __contains__(self, lump):
+        return lump in self.readers or lump in self.records
+
+    def __iter__(self):
+        yield from self.readers
+        for lump in self.records:
+            if lump not in self.readers:
+                yield lump
+
+    def __len__(self):
+        return len(set(self.readers) | set(self.records))
+
+    def array(self, lump) -> ndarray:
+        self.accessed.add(lump)
+        # decoded records might have been altered, so build the array
+        # from them instead of the file data
+        if lump in self.records:
+            records = self.records[lump]
+            data_class = self.readers[lump].data_class
+            if len(records) == 0:
+                return zeros(0, dtype=lump_dtype(data_class))
+            if lump in self.blob_lumps:
+                return frombuffer(records, dtype=lump_dtype(data_class))
+            return frombuffer(
+                (data_class * len(records))(*records),
+                dtype=lump_dtype(data_class))
+        if lump not in self.lump_arrays:
+            self.lump_arrays[lump] = self.readers[lump].readArray(
+                self.bsp_buffer)
+        return self.lump_arrays[lump]
+
+    def lump_buffer(self, lump):
+        # raw lump data without marking the lump as accessed
+        if lump in self.records and lump in self.blob_lumps:
+            return memoryview(self.records[lump])
+        accessed = lump in self.accessed
+        lump_array = self.array(lump)
+        if not accessed:
+            self.accessed.discard(lump)
+        return lump_array.view(uint8)
+
+    def count(self, lump) -> int:
+        if lump in self.records:
+            return len(self.records[lump])
+        return self.readers[lump].count
+
+    def is_decoded(self, lump) -> bool:
+        return lump in self.records or lump in self.lump_arrays
+
+    def accessed_lumps(self) -> List[str]:
+        return [lump for lump in self if lump in self.accessed]
+
+    def release_buffer(self):
+        if self.bsp_buffer is None:
+            return
+        for lump in self.readers:
+            if lump in self.records:
+                # decoded lumps don't read the file data anymore
+                self.lump_arrays.pop(lump, None)
+                continue
+            self.lump_arrays[lump] = self.readers[lump].readArray(
+                self.bsp_buffer).copy()
+        buffer = self.bsp_buffer
+        self.bsp_buffer = None
+        # close the mapping right away instead of relying on every view
+        # being garbage collected, the file can't be replaced otherwise
+        mapping = buffer
+        try:
+            if isinstance(buffer, memoryview):
+                mapping = buffer.obj
+                buffer.release()
+            if isinstance(mapping, mmap.mmap):
+                mapping.close()
+        except BufferError:
+            print("Could not close the bsp file mapping, "
+                  "some lump data is still in use")
+
+
+def gather_ranges(starts, counts) -> ndarray:
+    # concatenates the index ranges [start, start + count)
+    counts = asarray(counts, dtype=int32)
+    total = int(counts.sum())
+    if total == 0:
+        return zeros(0, dtype=int32)
+    range_starts = cumsum(counts) - counts
+    return (repeat(asarray(starts, dtype=int32) - range_starts, counts) +
+            arange(total, dtype=int32))
 
 
 LIGHTMAP_FORMATS = (".tga", ".png", ".jpg", ".hdr")
 
+# bump when the layout of the cache files changes
+BSP_CACHE_VERSION = 2
+
 
 class BSP_READER:
 
@@ -87,32 +274,37 @@ class BSP_READER:
 
     def __init__(self, VFS, import_settings):
         self.import_settings = import_settings
-        self.lumps = {}
         # for tracking some data down the pipeline
         self.lightgrid_origin = [0.0, 0.0, 0.0]
         self.lightgrid_z_step = 0.0
         self.lightgrid_inverse_dim = [0.0, 0.0, 0.0]
         self.lightgrid_dim = [0.0, 0.0, 0.0]
 
-        byte_array = VFS.get(import_settings.file)
+        byte_array = VFS.get_buffer(import_settings.file)
+        # loose file the buffer might be mapped from, None for pk3s
+        self.file_path = VFS.get_local_path(import_settings.file)
 
         if byte_array is None:
             raise Exception(
                 "Could not open BSP file: " + import_settings.file)
 
-        header = BSP_HEADER.from_buffer_copy(byte_array, 0)
-        if header.magic_nr not in self.MAGIC_MAPPING:
-            raise Exception(
-                'BSP format not supported')
-
-        bsp_info = self.MAGIC_MAPPING[header.magic_nr]
+        bsp_info = self.get_bsp_info(byte_array)
         self.header = bsp_info.header.from_buffer_copy(byte_array, 0)
-        offset = bsp_info.header_size
-        for lump in bsp_info.lumps:
-            lump_header = BSP_LUMP_HEADER.from_buffer_copy(byte_array, offset)
-            lump_reader = BSP_LUMP_READER(lump_header, bsp_info.lumps[lump])
-            self.lumps[lump] = lump_reader.readFrom(byte_array)
-            offset += sizeof(BSP_LUMP_HEADER)
+        lump_readers = self.read_lump_directory(byte_array, bsp_info)
+
+        self.lumps = BSP_LUMPS(byte_array,
+                               lump_readers,
+                               bsp_info.blob_lumps)
+        self.lump_arrays = self.lumps.arrays
+
+        # only derived info is cached, the lumps are zero-copy views
+        # of the file anyway
+        self.cache_path = None
+        cache = None
+        if import_settings.bsp_cache_dir:
+            self.cache_path = self.get_cache_path(
+                VFS, import_settings.file, import_settings.bsp_cache_dir)
+            cache = self.load_cache()
 
         self.map_name = import_settings.bsp_name[:-len(".bsp")]
         self.lump_info = bsp_info.lumps
@@ -126,96 +318,235 @@ class BSP_READER:
         self.use_lightgridarray = bsp_info.use_lightgridarray
         self.lerp_vertices = bsp_info.lerp_vertices
         self.lightmap_lumps = bsp_info.lightmap_lumps
-        self.compute_lightmap_info(VFS)
-        self.find_shader_based_external_lightmaps(VFS)
+        self.compute_lightmap_info(VFS, cache)
+        # shader parsing is only needed when building models, so defer it
+        self.VFS = VFS
+        self._lightmap_tc_shaders = None
+        self._vis_bits = None
+        if (cache is not None and
+                cache["lightmap_tc_shaders"] is not None and
+                cache["shader_key"] == self.get_shader_key()):
+            self._lightmap_tc_shaders = cache["lightmap_tc_shaders"]
+
+    @classmethod
+    def get_bsp_info(cls, byte_array):
+        header = BSP_HEADER.from_buffer_copy(byte_array, 0)
+        if header.magic_nr not in cls.MAGIC_MAPPING:
+            raise Exception(
+                'BSP format not supported')
+        return cls.MAGIC_MAPPING[header.magic_nr]
+
+    @staticmethod
+    def read_lump_directory(byte_array, bsp_info) -> dict:
+        offset = bsp_info.header_size
+        lump_readers = {}
+        for lump in bsp_info.lumps:
+            lump_header = BSP_LUMP_HEADER.from_buffer_copy(byte_array, offset)
+            lump_readers[lump] = BSP_LUMP_READER(
+                lump_header, bsp_info.lumps[lump])
+            offset += sizeof(BSP_LUMP_HEADER)
+        return lump_readers
+
+    @classmethod
+    def probe(cls, VFS, path, with_entities=False) -> dict:
+        # partial reads, so compressed maps are not inflated completely
+        header = VFS.read_range(path, 0, sizeof(BSP_HEADER))
+        if header is None or len(header) < sizeof(BSP_HEADER):
+            raise Exception("Could not open BSP file: " + path)
+        bsp_info = cls.get_bsp_info(header)
+        directory = VFS.read_range(
+            path, 0,
+            bsp_info.header_size +
+            len(bsp_info.lumps) * sizeof(BSP_LUMP_HEADER))
+        probe = cls.probe_bytes(directory)
+        if with_entities:
+            lump = probe["lumps"]["entities"]
+            entities = VFS.read_range(path, lump["offset"], lump["size"])
+            probe["entities"] = entities.replace(
+                b"\x00", b"").decode("latin-1")
+        return probe
+
+    @classmethod
+    def probe_bytes(cls, byte_array, with_entities=False) -> dict:
+        # only reads the header and the lump directory, plus the entity
+        # string when asked for
+        bsp_info = cls.get_bsp_info(byte_array)
+        header = bsp_info.header.from_buffer_copy(byte_array, 0)
+        lump_readers = cls.read_lump_directory(byte_array, bsp_info)
+        probe = {
+            "format": header.magic_nr.decode("latin-1"),
+            "version": header.version_nr,
+            "lumps": {lump: {"offset": reader.offset,
+                             "size": reader.size,
+                             "count": reader.count}
+                      for lump, reader in lump_readers.items()},
+            "entities": None
+        }
+        if with_entities:
+            reader = lump_readers["entities"]
+            entities = bytes(
+                byte_array[reader.offset:reader.offset + reader.size])
+            probe["entities"] = entities.replace(
+                b"\x00", b"").decode("latin-1")
+        return probe
+
+    def get_cache_path(self, VFS, file_path, cache_dir) -> str:
+        # the vfs stamp plus the format version identify a bsp, hashing
+        # the content would read the whole mapped file
+        stamp = VFS.get_stamp(file_path)
+        if stamp is None:
+            return None
+        return os.path.join(cache_dir, "{}_{}{}_{}.json".format(
+            sha1(repr((file_path.lower(), stamp)).encode(
+                "utf-8")).hexdigest(),
+            self.header.magic_nr.decode("latin-1").strip("!"),
+            self.header.version_nr,
+            BSP_CACHE_VERSION))
+
+    def get_shader_key(self) -> str:
+        # lightmap_tc_shaders depends on the shader files and on the
+        # shaders lump, which might have been edited since loading
+        return sha1((get_shader_files_key(self.VFS, self.import_settings) +
+                     sha1(self.lumps.lump_buffer("shaders")).hexdigest()
+                     ).encode("utf-8")).hexdigest()
+
+    def load_cache(self) -> dict:
+        if self.cache_path is None or not os.path.isfile(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, "r") as file:
+                return json.load(file)
+        except Exception as e:
+            print("Could not load bsp cache", self.cache_path, e)
+            return None
+
+    def save_cache(self):
+        # num_internal_lm_ids and deluxemapping are computed before
+        # anything can edit the lumps
+        cache = {
+            "num_internal_lm_ids": self.num_internal_lm_ids,
+            "deluxemapping": self.internal_deluxemapping,
+            "lightmap_tc_shaders": self._lightmap_tc_shaders,
+            "shader_key": self.get_shader_key()
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            file_handle, temp_path = tempfile.mkstemp(
+                suffix=".tmp", dir=os.path.dirname(self.cache_path))
+            with os.fdopen(file_handle, "w") as file:
+                json.dump(cache, file)
+            os.replace(temp_path, self.cache_path)
+        except Exception as e:
+            print("Could not write bsp cache", self.cache_path, e)
+
+    @property
+    def lightmap_tc_shaders(self) -> List[int]:
+        if self._lightmap_tc_shaders is None:
+            self.find_shader_based_external_lightmaps(self.VFS)
+            if self.cache_path is not None:
+                self.save_cache()
+        return self._lightmap_tc_shaders
+
+    @lightmap_tc_shaders.setter
+    def lightmap_tc_shaders(self, shader_ids):
+        self._lightmap_tc_shaders = shader_ids
+
+    def release_buffer(self):
+        # lump arrays view the (possibly memory mapped) bsp file, copy
+        # them so the mapping gets closed and the file can be overwritten
+        self.lumps.release_buffer()
 
     def set_entity_lump(self, entity_text):
-        bsp_info = self.MAGIC_MAPPING[self.header.magic_nr]
-        self.lumps["entities"] = [bsp_info.lumps["entities"]
-                                  (char=bytes(c, "latin-1"))
-                                  for c in entity_text]
+        self.lumps["entities"] = entity_text.encode("latin-1")
+
+    def get_file_chunks(self) -> list:
+        # header, lump directory and lump data in file order, offsets are
+        # computed up front from the lump sizes
+        lump_buffers = [self.lumps.lump_buffer(lump) for lump in self.lumps]
+        directory = (BSP_LUMP_HEADER * len(lump_buffers))()
+        offset = sizeof(self.header) + sizeof(directory)
+        for l_header, lump_buffer in zip(directory, lump_buffers):
+            l_header.offset = offset
+            l_header.size = lump_buffer.nbytes
+            offset += lump_buffer.nbytes
+        return [bytes(self.header), bytes(directory)] + lump_buffers
 
     def to_bytes(self):
-        byte_array = bytearray()
-        offset = 0
-
-        byte_array += bytes(self.header)
-        offset += sizeof(self.header)
-
-        lumps = {}
-        lump_sizes = {}
-        for lump in self.lumps:
-            lumps[lump] = bytearray()
-            lump_sizes[lump] = 0
-            for entry in self.lumps[lump]:
-                lumps[lump] += bytes(entry)
-                lump_sizes[lump] += sizeof(entry)
-
-        offset += sizeof(BSP_LUMP_HEADER) * len(self.lumps)
-        for lump in self.lumps:
-            l_header = BSP_LUMP_HEADER(
-                offset=offset,
-                size=lump_sizes[lump]
-            )
-            byte_array += bytes(l_header)
-            offset += lump_sizes[lump]
-
-        for lump in self.lumps:
-            byte_array += lumps[lump]
-
-        return byte_array
-
-    def compute_lightmap_info(self, VFS):
+        return bytearray().join(self.get_file_chunks())
+
+    def write_file(self, file_path):
+        # streams the lumps into a temporary file next to the target and
+        # swaps it in afterwards, so a failed write never leaves a
+        # half-written map behind
+        file_path = os.path.abspath(file_path)
+        if (self.file_path is not None and
+                os.path.exists(file_path) and
+                os.path.samefile(self.file_path, file_path)):
+            # overwriting the file this bsp is mapped from, which
+            # windows only allows once the mapping is closed
+            self.release_buffer()
+        file_handle, temp_path = tempfile.mkstemp(
+            suffix=".tmp",
+            prefix=os.path.basename(file_path) + ".",
+            dir=os.path.dirname(file_path))
+        try:
+            with os.fdopen(file_handle, "wb") as file:
+                for chunk in self.get_file_chunks():
+                    file.write(chunk)
+            # mkstemp only grants access to the owner
+            if os.path.exists(file_path):
+                shutil.copymode(file_path, temp_path)
+            else:
+                os.chmod(temp_path, 0o644)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def compute_lightmap_info(self, VFS, cache=None):
         # get external lightmap data
         # assumes that standard lightmaps are in the lightmap_lumps array first
         # also assumes external lightmaps are all the same format
         self.external_lm_files = []
-        if len(self.lumps[self.lightmap_lumps[0]]) == 0:
-            reg_path = self.map_name + "/lm_[0-9]{4}"
+        if self.lumps.count(self.lightmap_lumps[0]) == 0:
+            lm_pattern = self.map_name + "/lm_[0-9][0-9][0-9][0-9]"
             for format in LIGHTMAP_FORMATS:
-                external_lm_files = VFS.search(reg_path + format)
+                external_lm_files = VFS.glob(lm_pattern + format)
                 if external_lm_files:
                     break
             if external_lm_files:
                 self.external_lm_files = external_lm_files
 
+        if cache is not None:
+            self.num_internal_lm_ids = cache["num_internal_lm_ids"]
+            self.internal_deluxemapping = cache["deluxemapping"]
+        else:
+            self.compute_internal_lightmap_info()
         # check if we should pack lightmap tcs or not,
         # packing lightmap tcs is not supported for shader
         # based external lightmaps
-        num_internal_lm_ids = -1
-        for face in self.lumps["surfaces"]:
-            if self.lightmaps > 1:
-                current_max = max(face.lm_indexes)
-            else:
-                current_max = face.lm_indexes
-            if current_max == (1 << 30):
-                continue
-            num_internal_lm_ids = max(current_max, num_internal_lm_ids)
-        self.num_internal_lm_ids = num_internal_lm_ids
-        self.lm_packable = num_internal_lm_ids > 0
-
-        if num_internal_lm_ids == 0 and len(self.external_lm_files) == 2:
+        self.lm_packable = self.num_internal_lm_ids > 0
+        self.deluxemapping = self.internal_deluxemapping
+        if self.num_internal_lm_ids == 0 and len(self.external_lm_files) == 2:
             self.deluxemapping = True
-            return
+
+    def compute_internal_lightmap_info(self):
+        lm_indexes = self.lump_arrays["surfaces"]["lm_indexes"]
+        if self.lightmaps > 1:
+            face_max = lm_indexes.max(axis=1, initial=-1)
+        else:
+            face_max = lm_indexes
+        face_max = face_max[face_max != (1 << 30)]
+        num_internal_lm_ids = int(face_max.max(initial=-1))
+        self.num_internal_lm_ids = num_internal_lm_ids
 
         # check if the map utilizes deluxemapping
         if num_internal_lm_ids <= 0:
-            self.deluxemapping = False
+            self.internal_deluxemapping = False
         else:
-            self.deluxemapping = True
-            if self.lightmaps > 1:
-                for face in self.lumps["surfaces"]:
-                    for i in range(self.lightmaps):
-                        if (face.lm_indexes[i] % 2 == 1 and
-                                face.lm_indexes[i] >= 0):
-                            self.deluxemapping = False
-                            break
-            else:
-                for face in self.lumps["surfaces"]:
-                    if (face.lm_indexes % 2 == 1 and
-                            face.lm_indexes >= 0):
-                        self.deluxemapping = False
-                        break
+            odd_lm_ids = (lm_indexes % 2 == 1) & (lm_indexes >= 0)
+            self.internal_deluxemapping = not odd_lm_ids.any()
 
     def compute_packed_lightmap_size(self) -> Tuple[int, int]:
         if not self.lm_packable:
@@ -251,12 +582,121 @@ class BSP_READER:
             material_id_matching[shader_name] = shader_id
             materials.append(shader_name)
         material_dicts = get_material_dicts(VFS, self.import_settings, materials)
-        self.lightmap_tc_shaders = []
+        lightmap_tc_shaders = []
         for material in material_dicts:
             attributes, stages = material_dicts[material]
             for stage in stages:
                 if "tcgen" in stage and stage["tcgen"] == "lightmap":
-                    self.lightmap_tc_shaders.append(material_id_matching[material])
+                    lightmap_tc_shaders.append(material_id_matching[material])
+        self.lightmap_tc_shaders = lightmap_tc_shaders
+
+    def get_vis_bits(self) -> ndarray:
+        # packed pvs bit matrix, row a column byte b >> 3 holds the bit for
+        # cluster b, None when the map has no vis data
+        if self._vis_bits is None:
+            visdata = self.lumps["visdata"]
+            if len(visdata) < 8:
+                return None
+            num_clusters, bytes_per_cluster = unpack("<ii", visdata[:8])
+            if (num_clusters <= 0 or bytes_per_cluster <= 0 or
+                    len(visdata) < 8 + num_clusters * bytes_per_cluster):
+                return None
+            self._vis_bits = frombuffer(
+                visdata,
+                dtype=uint8,
+                count=num_clusters * bytes_per_cluster,
+                offset=8).reshape(num_clusters, bytes_per_cluster)
+        return self._vis_bits
+
+    def get_num_clusters(self) -> int:
+        vis_bits = self.get_vis_bits()
+        if vis_bits is not None:
+            return vis_bits.shape[0]
+        leaf_clusters = self.lump_arrays["leafs"]["cluster"]
+        return int(leaf_clusters.max(initial=-1)) + 1
+
+    def is_cluster_visible(self, cluster_a, cluster_b):
+        # accepts single clusters or arrays of clusters, like the renderer
+        # a viewer cluster outside of 0..num_clusters-1 (outside the map)
+        # sees every cluster, while such a target cluster (solid leafs)
+        # is never visible
+        cluster_a = asarray(cluster_a, dtype=int32)
+        cluster_b = asarray(cluster_b, dtype=int32)
+        num_clusters = self.get_num_clusters()
+        valid_b = (cluster_b >= 0) & (cluster_b < num_clusters)
+        vis_bits = self.get_vis_bits()
+        if vis_bits is None:
+            return valid_b & ones(cluster_a.shape, dtype=bool)
+        outside_a = (cluster_a < 0) | (cluster_a >= num_clusters)
+        a = cluster_a.clip(0, num_clusters - 1)
+        b = cluster_b.clip(0, num_clusters - 1)
+        visible = ((vis_bits[a, b >> 3] >> (b & 7)) & 1).astype(bool)
+        return valid_b & (outside_a | visible)
+
+    def visible_clusters(self, cluster) -> ndarray:
+        # same rules as is_cluster_visible, a cluster outside of the map
+        # sees every cluster
+        num_clusters = self.get_num_clusters()
+        if cluster < 0 or cluster >= num_clusters:
+            return arange(num_clusters, dtype=int32)
+        vis_bits = self.get_vis_bits()
+        if vis_bits is None:
+            return arange(num_clusters, dtype=int32)
+        cluster_bits = unpackbits(vis_bits[cluster], bitorder="little")
+        return flatnonzero(cluster_bits[:num_clusters]).astype(int32)
+
+    def find_leaves(self, points) -> Tuple[ndarray, ndarray, ndarray]:
+        # walks all points through the bsp tree at once, one tree level
+        # per iteration, returns leaf, cluster and area per point
+        points = asarray(points, dtype=float64).reshape(-1, 3)
+        nodes = self.lump_arrays["nodes"]
+        planes = self.lump_arrays["planes"]
+        leafs = self.lump_arrays["leafs"]
+        leaf_ids = zeros(len(points), dtype=int32)
+
+        if len(nodes) > 0:
+            node_planes = nodes["plane"]
+            node_children = nodes["children"]
+            plane_normals = planes["normal"].astype(float64)
+            plane_distances = planes["distance"].astype(float64)
+
+            point_ids = arange(len(points))
+            node_ids = zeros(len(points), dtype=int32)
+            # guards against malformed trees that contain loops
+            for depth in range(len(nodes) + 1):
+                if len(point_ids) == 0:
+                    break
+                plane_ids = node_planes[node_ids]
+                distances = einsum(
+                    "ij,ij->i",
+                    points[point_ids],
+                    plane_normals[plane_ids]) - plane_distances[plane_ids]
+                node_ids = node_children[
+                    node_ids, (distances < 0.0).astype(intp)]
+                in_leaf = node_ids < 0
+                leaf_ids[point_ids[in_leaf]] = -node_ids[in_leaf] - 1
+                point_ids = point_ids[~in_leaf]
+                node_ids = node_ids[~in_leaf]
+
+        if len(leafs) == 0:
+            invalid = zeros(len(points), dtype=int32) - 1
+            return leaf_ids, invalid, invalid.copy()
+        return leaf_ids, leafs["cluster"][leaf_ids], leafs["area"][leaf_ids]
+
+    def find_leaf(self, point) -> int:
+        leaf_ids, clusters, areas = self.find_leaves([point])
+        return int(leaf_ids[0])
+
+    def visible_surfaces(self, point) -> ndarray:
+        # surface ids in the pvs of the point, like the renderer all leafs
+        # are visible when the point is outside of any cluster
+        leafs = self.lump_arrays["leafs"]
+        cluster = leafs["cluster"][self.find_leaf(point)]
+        leaf_mask = self.is_cluster_visible(cluster, leafs["cluster"])
+        leaffaces = self.lump_arrays["leaffaces"]["face"]
+        leafface_ids = gather_ranges(leafs["leafface"][leaf_mask],
+                                     leafs["n_leaffaces"][leaf_mask])
+        return unique(leaffaces[leafface_ids])
 
     def get_bsp_entity_objects(self) -> dict:
         return OBJECT.get_entity_objects_from_bsp(self)
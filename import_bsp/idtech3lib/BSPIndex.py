@@ -0,0 +1,270 @@
+import json
+import os
+import sqlite3
+
+from numpy import unique
+
+from .BSP import BSP_READER
+from .ID3VFS import Q3VFS
+from .ImportSettings import Import_Settings, Surface_Type
+from .Parsing import l_open, l_close, parse
+from . import Workers
+
+# keys of entities that reference external models
+MODEL_KEYS = ("model", "model2")
+
+CATALOGUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS maps (
+    name TEXT PRIMARY KEY,
+    source TEXT,
+    format TEXT,
+    version INTEGER,
+    lightmaps INTEGER,
+    deluxemapping INTEGER,
+    mins_x REAL, mins_y REAL, mins_z REAL,
+    maxs_x REAL, maxs_y REAL, maxs_z REAL
+);
+CREATE TABLE IF NOT EXISTS map_entities (
+    map TEXT, classname TEXT, count INTEGER);
+CREATE TABLE IF NOT EXISTS map_models (
+    map TEXT, model TEXT);
+CREATE TABLE IF NOT EXISTS map_shaders (
+    map TEXT, shader TEXT);
+CREATE TABLE IF NOT EXISTS map_surfaces (
+    map TEXT, type TEXT, count INTEGER);
+CREATE INDEX IF NOT EXISTS map_shaders_shader ON map_shaders (shader);
+CREATE INDEX IF NOT EXISTS map_models_model ON map_models (model);
+"""
+
+
+def get_entity_dicts(entities_string):
+    # only splits the entity lump into key value pairs, the full
+    # conversion is done by ImportEntitiesText when importing
+    entities = []
+    ent = {}
+    for line in entities_string.splitlines():
+        if l_open(line):
+            ent = {}
+        elif l_close(line):
+            entities.append(ent)
+        elif line.strip(" \t\r") != "":
+            key, value = parse(line)
+            key = key.strip(" \"\t\n\r").lower()
+            value = value.strip(" \"\'\t\n\r").replace("\\", "/")
+            ent[key] = value
+    return entities
+
+
+def get_map_source(VFS, path):
+    retriever = VFS.index.get(path.lower())
+    if retriever is None:
+        return path
+    return retriever.source()
+
+
+def index_map(VFS, path) -> dict:
+    import_settings = Import_Settings(file=path)
+    bsp = BSP_READER(VFS, import_settings)
+
+    entities_string = bsp.lumps["entities"].replace(
+        b"\x00", b"").decode("latin-1")
+    classnames = {}
+    models = set()
+    for ent in get_entity_dicts(entities_string):
+        classname = ent.get("classname", "")
+        classnames[classname] = classnames.get(classname, 0) + 1
+        for key in MODEL_KEYS:
+            model = ent.get(key, "")
+            if model and not model.startswith("*"):
+                models.add(model.lower())
+
+    shaders = set()
+    for name in bsp.lump_arrays["shaders"]["name"]:
+        shaders.add(name.split(b"\x00")[0].decode("latin-1").lower())
+
+    surface_types = {}
+    types, counts = unique(
+        bsp.lump_arrays["surfaces"]["type"], return_counts=True)
+    for surface_type, count in zip(types.tolist(), counts.tolist()):
+        name = Surface_Type.bsp_value(surface_type).name
+        surface_types[name] = surface_types.get(name, 0) + count
+
+    # internal lightmaps, or the external ones when the lump is empty
+    lightmaps = 0
+    if len(bsp.lightmap_lumps) > 0:
+        lightmaps = bsp.lumps.count(bsp.lightmap_lumps[0])
+        if lightmaps == 0:
+            lightmaps = len(bsp.external_lm_files)
+
+    mins = [0.0, 0.0, 0.0]
+    maxs = [0.0, 0.0, 0.0]
+    if bsp.lumps.count("models") > 0:
+        world = bsp.lump_arrays["models"][0]
+        mins = world["mins"].tolist()
+        maxs = world["maxs"].tolist()
+
+    return {
+        "name": path,
+        "source": get_map_source(VFS, path),
+        "format": bsp.header.magic_nr.decode("latin-1"),
+        "version": bsp.header.version_nr,
+        "lightmaps": lightmaps,
+        "deluxemapping": bsp.deluxemapping,
+        "mins": mins,
+        "maxs": maxs,
+        "entities": classnames,
+        "models": sorted(models),
+        "shaders": sorted(shaders),
+        "surface_types": surface_types,
+    }
+
+
+# every worker process builds its own vfs once
+_worker_vfs = None
+_worker_vfs_key = None
+
+
+def get_worker_vfs(base_paths, cache_dir):
+    global _worker_vfs, _worker_vfs_key
+    if _worker_vfs_key != (base_paths, cache_dir):
+        _worker_vfs = Q3VFS(cache_dir)
+        for base_path in base_paths:
+            _worker_vfs.add_base(base_path)
+        _worker_vfs.build_index()
+        _worker_vfs_key = (base_paths, cache_dir)
+    return _worker_vfs
+
+
+def index_map_worker(path, base_paths, cache_dir):
+    try:
+        return index_map(get_worker_vfs(base_paths, cache_dir), path)
+    except Exception as e:
+        return {"name": path, "error": str(e)}
+
+
+def find_maps(VFS):
+    return sorted(VFS.list_dir(ext=".bsp", recursive=True))
+
+
+def index_maps(VFS, maps=None, workers=None) -> list:
+    if maps is None:
+        maps = find_maps(VFS)
+    if workers == 1 or len(maps) < 2:
+        entries = []
+        for path in maps:
+            try:
+                entries.append(index_map(VFS, path))
+            except Exception as e:
+                entries.append({"name": path, "error": str(e)})
+    else:
+        base_paths = tuple(VFS.basepaths)
+        with Workers.create_pool(workers) as executor:
+            entries = list(executor.map(
+                Workers.worker_function(index_map_worker),
+                maps,
+                [base_paths] * len(maps),
+                [VFS.cache_dir] * len(maps),
+                chunksize=4))
+    for entry in entries:
+        if "error" in entry:
+            print("Could not index", entry["name"], entry["error"])
+    return entries
+
+
+def write_catalogue_json(entries, file_path):
+    with open(file_path, "w") as fh:
+        json.dump(entries, fh, indent=1)
+
+
+CATALOGUE_TABLES = ("maps", "map_entities", "map_models",
+                    "map_shaders", "map_surfaces")
+
+
+def delete_catalogue_map(connection, name):
+    for table in CATALOGUE_TABLES:
+        key = "name" if table == "maps" else "map"
+        connection.execute(
+            "DELETE FROM {} WHERE {} = ?".format(table, key), (name,))
+
+
+# full writes hold every map of the game and drop the maps that are gone,
+# otherwise only the given maps are replaced
+def write_catalogue(entries, db_path, full=False):
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.executescript(CATALOGUE_SCHEMA)
+        with connection:
+            if full:
+                names = set(entry["name"] for entry in entries)
+                for (name,) in connection.execute(
+                        "SELECT name FROM maps").fetchall():
+                    if name not in names:
+                        delete_catalogue_map(connection, name)
+            for entry in entries:
+                if "error" in entry:
+                    continue
+                name = entry["name"]
+                delete_catalogue_map(connection, name)
+                connection.execute(
+                    "INSERT INTO maps VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (name, entry["source"], entry["format"],
+                     entry["version"], entry["lightmaps"],
+                     int(entry["deluxemapping"]),
+                     *entry["mins"], *entry["maxs"]))
+                connection.executemany(
+                    "INSERT INTO map_entities VALUES (?, ?, ?)",
+                    [(name, classname, count) for classname, count
+                     in entry["entities"].items()])
+                connection.executemany(
+                    "INSERT INTO map_models VALUES (?, ?)",
+                    [(name, model) for model in entry["models"]])
+                connection.executemany(
+                    "INSERT INTO map_shaders VALUES (?, ?)",
+                    [(name, shader) for shader in entry["shaders"]])
+                connection.executemany(
+                    "INSERT INTO map_surfaces VALUES (?, ?, ?)",
+                    [(name, surface_type, count) for surface_type, count
+                     in entry["surface_types"].items()])
+    finally:
+        connection.close()
+
+
+def build_catalogue(VFS, db_path=None, json_path=None, workers=None):
+    entries = index_maps(VFS, workers=workers)
+    if db_path is not None:
+        write_catalogue(entries, db_path, full=True)
+    if json_path is not None:
+        write_catalogue_json(entries, json_path)
+    return entries
+
+
+def query_catalogue(db_path, query, args):
+    if not os.path.isfile(db_path):
+        raise Exception("Map catalogue not found: " + db_path)
+    connection = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in connection.execute(query, args)]
+    finally:
+        connection.close()
+
+
+def maps_using_shader(db_path, shader) -> list:
+    return query_catalogue(
+        db_path,
+        "SELECT map FROM map_shaders WHERE shader = ? ORDER BY map",
+        (shader.lower(),))
+
+
+def maps_using_model(db_path, model) -> list:
+    return query_catalogue(
+        db_path,
+        "SELECT map FROM map_models WHERE model = ? ORDER BY map",
+        (model.lower().replace("\\", "/"),))
+
+
+def maps_with_entity(db_path, classname) -> list:
+    return query_catalogue(
+        db_path,
+        "SELECT map FROM map_entities WHERE classname = ? ORDER BY map",
+        (classname,))
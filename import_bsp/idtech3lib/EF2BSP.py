@@ -217,6 +217,20 @@ class BSP_INFO:
                       "baselightmaps",
                       "contlightmaps")
 
+    blob_lumps = ("entities",
+                  "visdata",
+                  "entlights",
+                  "entlightvis",
+                  "lightdefs",
+                  "baselightingverts",
+                  "contlightingverts",
+                  "baselightingsurfs",
+                  "lightingsurfs",
+                  "lightingvertsurfs",
+                  "lightinggroups",
+                  "staticLodModels",
+                  "bspinfo")
+
     @classmethod
     def lerp_vertices(
             cls,
@@ -202,6 +202,12 @@ class BSP_INFO:
     lightmap_lumps = ("lightmaps",
                       )
 
+    blob_lumps = ("entities",
+                  "visdata",
+                  "entlights",
+                  "entlightvis",
+                  "lightdefs")
+
     @classmethod
     def lerp_vertices(
             cls,
@@ -33,6 +33,8 @@ class BSP_INFO:
 
     lightmap_lumps = ("lightmaps",)
 
+    blob_lumps = RBSP.blob_lumps
+
     @classmethod
     def lerp_vertices(
             cls,
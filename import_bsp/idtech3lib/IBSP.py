@@ -196,6 +196,8 @@ class BSP_INFO:
 
     lightmap_lumps = ("lightmaps",)
 
+    blob_lumps = ("entities", "visdata")
+
     @classmethod
     def lerp_vertices(
             cls,
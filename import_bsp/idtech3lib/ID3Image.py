@@ -1,5 +1,6 @@
 # -*- coding: UTF-8 -*-
 
+import io
 import struct
 from numpy import array
 
@@ -134,3 +135,44 @@ def get_image_dimensions_from_bytearray(byte_array, force_tga = False):
         print("Could not read image size. Assuming default 128x128")
 
     return float(width), float(height)
+
+
+def get_jpeg_dimensions_from_file(file):
+    # walks the segment markers up to the frame header, segments are
+    # skipped without reading them
+    file.seek(2)
+    b = file.read(1)
+    while (b and b != b'\xda'):
+        while (b and b != b'\xff'):
+            b = file.read(1)
+        while (b == b'\xff'):
+            b = file.read(1)
+        if (b >= b'\xc0' and b <= b'\xc3'):
+            h, w = struct.unpack(">xxxHH", file.read(7))
+            return float(w), float(h)
+        struct_size = int(struct.unpack(">H", file.read(2))[0])
+        file.seek(struct_size - 2, io.SEEK_CUR)
+        b = file.read(1)
+    raise Exception("No frame header found")
+
+
+def get_image_dimensions_from_file(file, force_tga=False):
+    """
+    Return (width, height) for a seekable img file, only reads the
+    bytes needed to find the dimensions
+    """
+    data = file.read(24)
+    if data.startswith(b'\377\330'):
+        msg = " raised while trying to decode as JPEG."
+        try:
+            return get_jpeg_dimensions_from_file(file)
+        except Exception as e:
+            raise Exception(e.__class__.__name__ + msg)
+    if (not force_tga and
+            data[:6] not in (b'GIF87a', b'GIF89a') and
+            not data.startswith(b'\211PNG\r\n\032\n')):
+        size = file.seek(0, io.SEEK_END)
+        if size >= 18:
+            file.seek(size - 18)
+            force_tga = file.read(18) == b'TRUEVISION-XFILE.\0'
+    return get_image_dimensions_from_bytearray(data, force_tga)
@@ -196,9 +196,5 @@ class ID3Object:
     @staticmethod
     def get_entity_objects_from_bsp(bsp):
         lump = bsp.lumps["entities"]
-        stringdata = []
-        for i in lump:
-            stringdata.append(i.char.decode("latin-1"))
-
-        entities_string = "".join(stringdata)
+        entities_string = lump.replace(b"\x00", b"").decode("latin-1")
         return ImportEntitiesText(entities_string)
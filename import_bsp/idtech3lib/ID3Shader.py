@@ -1,5 +1,13 @@
 from .Parsing import *
+from concurrent.futures.process import BrokenProcessPool
+from copy import deepcopy
+from hashlib import sha1
+import json
+import os
+import tempfile
+from weakref import WeakKeyDictionary
 from . import ID3Image as Image
+from . import Workers
 
 
 def create_white_image():
@@ -12,76 +20,430 @@ def create_white_image():
     return image
 
 
-def get_material_dicts(VFS, import_settings, material_list):
-
+def get_shader_files(VFS, import_settings):
+    shader_list = []
     for shader_path in import_settings.shader_dirs:
-        reg = "^" + shader_path + r"(.*?).shader$"
-        shader_list = VFS.search(reg)
+        shader_list = VFS.list_dir(shader_path, ".shader", recursive=True)
         if len(shader_list) > 0:
             break
+    return shader_list
 
-    shader_info = {}
-
-    for shader_file in shader_list:
-        shader_bytearray = VFS.get(shader_file)
-        lines = shader_bytearray.decode(encoding="latin-1").splitlines()
-
-        current_shader = None
-        stage = {}
-        attributes = {}
-        stages = []
-        is_open = 0
-        for line_num, line in enumerate(lines):
-            # trim line
-            line = l_format(line)
-            # skip empty lines or comments
-            if (l_empty(line) or l_comment(line)):
-                continue
-            # content
-            if (not l_open(line) and not l_close(line)):
-                # shader names
-                if is_open == 0:
-                    if line in material_list:
-                        current_shader = line
-                        attributes["first_line"] = line_num + 1
-                        attributes["shader_file"] = shader_file
-                # shader attributes
-                elif is_open == 1 and current_shader:
-                    key, value = parse(line)
-                    if key in attributes:
-                        attributes[key].append(value)
-                    else:
-                        attributes[key] = [value]
-                # stage info
-                elif is_open == 2 and current_shader:
-                    key, value = parse(line)
-                    # FIXME: multiple tcMods are supported by the game engine
-                    stage[key] = value
-            # marker open
-            elif l_open(line):
-                is_open = is_open + 1
-            # marker close
-            elif l_close(line):
-                # close stage
-                if is_open == 2 and current_shader:
-                    stages.append(stage)
-                    stage = {}
-                # close material
-                elif is_open == 1 and current_shader:
-                    if current_shader not in shader_info:
-                        shader_info[current_shader] = attributes, stages
-                    attributes = {}
-                    stages = []
-                    current_shader = None
-                is_open -= 1
+
+# changes whenever a shader file is added, removed or edited
+def get_shader_files_key(VFS, import_settings):
+    stamps = [(shader_file, VFS.get_stamp(shader_file))
+              for shader_file in get_shader_files(VFS, import_settings)]
+    return sha1(repr(stamps).encode("utf-8")).hexdigest()
+
+
+def parse_shader_lines(lines, shader_file, material_list, shader_info,
+                       line_offset=0):
+    current_shader = None
+    stage = {}
+    attributes = {}
+    stages = []
+    is_open = 0
+    for line_num, line in enumerate(lines, line_offset):
+        # trim line
+        line = l_format(line)
+        # skip empty lines or comments
+        if (l_empty(line) or l_comment(line)):
+            continue
+        # content
+        if (not l_open(line) and not l_close(line)):
+            # shader names
+            if is_open == 0:
+                if line in material_list:
+                    current_shader = line
+                    attributes["first_line"] = line_num + 1
+                    attributes["shader_file"] = shader_file
+            # shader attributes
+            elif is_open == 1 and current_shader:
+                key, value = parse(line)
+                if key in attributes:
+                    attributes[key].append(value)
+                else:
+                    attributes[key] = [value]
+            # stage info
+            elif is_open == 2 and current_shader:
+                key, value = parse(line)
+                # FIXME: multiple tcMods are supported by the game engine
+                stage[key] = value
+        # marker open
+        elif l_open(line):
+            is_open = is_open + 1
+        # marker close
+        elif l_close(line):
+            # close stage
+            if is_open == 2 and current_shader:
+                stages.append(stage)
+                stage = {}
+            # close material
+            elif is_open == 1 and current_shader:
+                if current_shader not in shader_info:
+                    shader_info[current_shader] = attributes, stages
+                attributes = {}
+                stages = []
+                current_shader = None
+            is_open -= 1
     return shader_info
 
 
+# finds all shader definitions in a shader file without parsing them
+# returns (name, start, end, first_line) with character offsets
+def scan_shader_text(text):
+    definitions = []
+    name = None
+    name_start = 0
+    name_line = 0
+    is_open = 0
+    offset = 0
+    for line_num, raw_line in enumerate(text.splitlines(True)):
+        line_start = offset
+        offset += len(raw_line)
+        line = l_format(raw_line)
+        if (l_empty(line) or l_comment(line)):
+            continue
+        if (not l_open(line) and not l_close(line)):
+            if is_open == 0:
+                name = line
+                name_start = line_start
+                name_line = line_num
+        elif l_open(line):
+            is_open = is_open + 1
+        elif l_close(line):
+            if is_open == 1 and name is not None:
+                definitions.append((name, name_start, offset, name_line + 1))
+                name = None
+            is_open -= 1
+    return definitions
+
+
+# bump when the scanned or parsed shader format changes
+SHADER_CACHE_VERSION = 2
+
+
+# one cache file per shader file and archive or local path, so the cache
+# can be shared between base paths and edits replace the old entry
+# the entry stores the stamp of the version it was made from
+def get_shader_cache_path(VFS, shader_file, stamp):
+    if not VFS.cache_dir or stamp is None:
+        return None
+    key = sha1(repr((shader_file, stamp[0])).encode("utf-8")).hexdigest()
+    return os.path.join(VFS.cache_dir, "shaders", key + ".json")
+
+
+def load_json_cache(cache_path, version):
+    if cache_path is None or not os.path.isfile(cache_path):
+        return None
+    try:
+        with open(cache_path, "r") as file:
+            cached = json.load(file)
+        if cached.get("version") == version:
+            return cached
+    except Exception as e:
+        print("Could not load cache", cache_path, e)
+    return None
+
+
+def save_json_cache(cache_path, entry):
+    if cache_path is None:
+        return
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        file_handle, temp_path = tempfile.mkstemp(
+            suffix=".tmp", dir=cache_dir)
+        with os.fdopen(file_handle, "w") as file:
+            json.dump(entry, file)
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        print("Could not write cache", cache_path, e)
+
+
+# parses shaders cut out of one shader file, returns name -> dicts
+def parse_shader_slices(shader_file, slices):
+    shaders = {}
+    for name, (text, first_line) in slices:
+        parse_shader_lines(text.splitlines(),
+                           shader_file,
+                           (name,),
+                           shaders,
+                           first_line - 1)
+    return shaders
+
+
+# the process pool only pays off for big cold scans, starting it costs
+# more than parsing a few megabytes of shader text
+MIN_PARALLEL_SHADER_BYTES = 8 * 1024 * 1024
+DEFAULT_SHADER_WORKERS = min(4, os.cpu_count() or 1)
+
+# one pool for the lifetime of the module, created on first use
+shader_pool = None
+shader_pool_workers = 0
+# set once workers could not be started, shaders are parsed in this
+# process from then on
+shader_pool_broken = False
+
+
+def get_shader_pool(workers):
+    global shader_pool, shader_pool_workers
+    if shader_pool is not None and shader_pool_workers != workers:
+        shutdown_shader_pool()
+    if shader_pool is None:
+        shader_pool = Workers.create_pool(workers)
+        shader_pool_workers = workers
+    return shader_pool
+
+
+def shutdown_shader_pool():
+    global shader_pool
+    if shader_pool is not None:
+        shader_pool.shutdown(wait=False)
+        shader_pool = None
+
+
+# calls function per shader file, results stay in file order
+def map_shader_files(function, *arguments, num_bytes=0, workers=1):
+    global shader_pool_broken
+    num_files = len(arguments[0])
+    if (workers > 1 and num_files > 1 and not shader_pool_broken and
+            num_bytes >= MIN_PARALLEL_SHADER_BYTES):
+        try:
+            return list(get_shader_pool(workers).map(
+                Workers.worker_function(function), *arguments,
+                chunksize=max(1, num_files // (workers * 4))))
+        except Exception as e:
+            print("Could not parse shaders in parallel", e)
+            shutdown_shader_pool()
+            if isinstance(e, BrokenProcessPool):
+                shader_pool_broken = True
+    return [function(*args) for args in zip(*arguments)]
+
+
+class ID3ShaderDatabase:
+    # knows where every shader is defined, shader files are only scanned
+    # again when they changed and shaders are only parsed when requested
+    def __init__(self):
+        self.shader_files = []
+        # shader file -> (stamp, cache entry), the cache entry holds the
+        # definitions and all shaders parsed so far
+        self.files = {}
+        # shader file -> text, only read when a shader needs parsing
+        self.texts = {}
+        # shader name -> (shader file, start, end, first line)
+        self.index = {}
+        # processes scanning and parsing big sets of shader files,
+        # 1 disables the pool
+        self.workers = DEFAULT_SHADER_WORKERS
+
+    def get_text(self, VFS, shader_file):
+        if shader_file not in self.texts:
+            self.texts[shader_file] = VFS.get(shader_file).decode(
+                encoding="latin-1")
+        return self.texts[shader_file]
+
+    def update(self, VFS, import_settings):
+        shader_files = get_shader_files(VFS, import_settings)
+        changed = shader_files != self.shader_files
+        scan_files = []
+        for shader_file in shader_files:
+            stamp = VFS.get_stamp(shader_file)
+            cached = self.files.get(shader_file)
+            if cached is not None and cached[0] == stamp:
+                continue
+            changed = True
+            self.texts.pop(shader_file, None)
+            entry = load_json_cache(
+                get_shader_cache_path(VFS, shader_file, stamp),
+                SHADER_CACHE_VERSION)
+            if entry is None or entry.get("stamp") != list(stamp or ()):
+                scan_files.append((shader_file, stamp))
+            else:
+                self.files[shader_file] = (stamp, entry)
+        texts = [self.get_text(VFS, shader_file)
+                 for shader_file, stamp in scan_files]
+        definitions = map_shader_files(
+            scan_shader_text,
+            texts,
+            num_bytes=sum(len(text) for text in texts),
+            workers=self.workers)
+        for (shader_file, stamp), file_definitions in zip(
+                scan_files, definitions):
+            entry = {
+                "version": SHADER_CACHE_VERSION,
+                "stamp": stamp,
+                "definitions": file_definitions,
+                "shaders": {}}
+            save_json_cache(
+                get_shader_cache_path(VFS, shader_file, stamp), entry)
+            self.files[shader_file] = (stamp, entry)
+        if not changed:
+            return
+        for shader_file in list(self.files):
+            if shader_file not in shader_files:
+                del self.files[shader_file]
+                self.texts.pop(shader_file, None)
+        # first definition wins, in the same order the files are parsed
+        self.index = {}
+        for shader_file in shader_files:
+            for name, start, end, first_line in (
+                    self.files[shader_file][1]["definitions"]):
+                if name not in self.index:
+                    self.index[name] = (shader_file, start, end, first_line)
+        self.shader_files = shader_files
+
+    def get_material_dicts(self, VFS, material_list):
+        # collect the shaders that were never parsed, per file
+        requests = {}
+        for material in material_list:
+            if material not in self.index:
+                continue
+            shader_file, start, end, first_line = self.index[material]
+            if material in self.files[shader_file][1]["shaders"]:
+                continue
+            slices = requests.setdefault(shader_file, {})
+            if material not in slices:
+                text = self.get_text(VFS, shader_file)
+                slices[material] = (text[start:end], first_line)
+
+        shader_files = list(requests)
+        parsed = map_shader_files(
+            parse_shader_slices,
+            shader_files,
+            [list(requests[shader_file].items())
+             for shader_file in shader_files],
+            num_bytes=sum(len(text) for slices in requests.values()
+                          for text, first_line in slices.values()),
+            workers=self.workers)
+        for shader_file, shaders in zip(shader_files, parsed):
+            stamp, entry = self.files[shader_file]
+            entry["shaders"].update(shaders)
+            save_json_cache(
+                get_shader_cache_path(VFS, shader_file, stamp), entry)
+
+        shader_info = {}
+        for material in material_list:
+            if material in shader_info or material not in self.index:
+                continue
+            shader_file = self.index[material][0]
+            # callers get their own copy of the cached dicts
+            attributes, stages = deepcopy(
+                self.files[shader_file][1]["shaders"][material])
+            shader_info[material] = attributes, stages
+        return shader_info
+
+
+# one database per vfs and shader dirs
+shader_databases = WeakKeyDictionary()
+
+
+def get_shader_database(VFS, import_settings):
+    if VFS not in shader_databases:
+        shader_databases[VFS] = {}
+    databases = shader_databases[VFS]
+    key = tuple(import_settings.shader_dirs)
+    if key not in databases:
+        databases[key] = ID3ShaderDatabase()
+    database = databases[key]
+    database.update(VFS, import_settings)
+    return database
+
+
+def get_material_dicts(VFS, import_settings, material_list):
+    database = get_shader_database(VFS, import_settings)
+    return database.get_material_dicts(VFS, material_list)
+
+
+# changes whenever the shader text or an image it references changes,
+# the line the shader starts at is left out so edits above it don't count
+def get_shader_build_key(VFS, name, attributes, stages, settings=()):
+    attributes = {key: value for key, value in attributes.items()
+                  if key not in ("first_line", "shader_file")}
+    tokens = [name]
+    for values in attributes.values():
+        for value in values:
+            tokens += value.split()
+    for stage in stages:
+        for value in stage.values():
+            tokens += value.split()
+    image_formats = ("",) + tuple(Image.extensions)
+    image_stamps = []
+    for token in tokens:
+        if "/" not in token:
+            continue
+        image_name = VFS.resolve(token, image_formats)
+        if image_name is not None:
+            image_stamps.append((image_name, VFS.get_stamp(image_name)))
+    key = repr((name, attributes, stages, image_stamps, settings))
+    return sha1(key.encode("utf-8")).hexdigest()
+
+
+# bump when the stored image sizes change
+IMAGE_SIZE_CACHE_VERSION = 2
+# vfs -> {"version", "sizes"}, sizes are keyed by path and archive or
+# local path and hold the stamp and the size of the image
+image_size_caches = WeakKeyDictionary()
+
+
+def get_image_size_cache_path(VFS):
+    if not VFS.cache_dir:
+        return None
+    return os.path.join(VFS.cache_dir, "image_sizes.json")
+
+
+def load_image_size_cache(VFS):
+    cache = load_json_cache(
+        get_image_size_cache_path(VFS), IMAGE_SIZE_CACHE_VERSION)
+    if cache is None:
+        cache = {"version": IMAGE_SIZE_CACHE_VERSION, "sizes": {}}
+    return cache
+
+
+def get_image_size_cache(VFS):
+    if VFS not in image_size_caches:
+        image_size_caches[VFS] = load_image_size_cache(VFS)
+    return image_size_caches[VFS]
+
+
+# other sessions share the file, so the new sizes are merged into what
+# is on disk now, sizes of archives or files that are gone are dropped
+def save_image_size_cache(VFS, new_sizes):
+    cache = load_image_size_cache(VFS)
+    cache["sizes"].update(new_sizes)
+    exists = {}
+    for key, (stamp, size) in list(cache["sizes"].items()):
+        if stamp[0] not in exists:
+            exists[stamp[0]] = os.path.exists(stamp[0])
+        if not exists[stamp[0]]:
+            del cache["sizes"][key]
+    image_size_caches[VFS] = cache
+    save_json_cache(get_image_size_cache_path(VFS), cache)
+
+
+# reads only the image header, sizes are remembered per file version
+# and sizes that had to be read are added to new_sizes
+def get_image_size(VFS, image_name, cache, new_sizes):
+    stamp = VFS.get_stamp(image_name)
+    key = repr((image_name.lower(), stamp and stamp[0]))
+    cached = cache["sizes"].get(key)
+    if cached is not None and cached[0] == list(stamp or ()):
+        return tuple(cached[1])
+    with VFS.open(image_name) as file:
+        size = Image.get_image_dimensions_from_file(
+            file, image_name.endswith(".tga"))
+    if stamp is not None:
+        cache["sizes"][key] = new_sizes[key] = [list(stamp), list(size)]
+    return size
+
+
 def get_shader_image_sizes(VFS, import_settings, material_list):
 
     shader_info = get_material_dicts(VFS, import_settings, material_list)
     image_formats = ("", ".tga", ".png", ".jpg")
     material_sizes = {}
+    cache = get_image_size_cache(VFS)
+    new_sizes = {}
 
     no_shader_mats = [mat for mat in material_list if mat not in shader_info]
     for mat in no_shader_mats:
@@ -90,48 +452,27 @@ def get_shader_image_sizes(VFS, import_settings, material_list):
     for shader in shader_info:
         attributes, stages = shader_info[shader]
         if "qer_editorimage" in attributes:
-            for fmt in image_formats:
-                image_name = attributes["qer_editorimage"][0]+fmt
-                editor_image = VFS.get(image_name)
-                if editor_image is not None:
-                    material_sizes[shader.lower()] = (
-                        Image.get_image_dimensions_from_bytearray(
-                            editor_image,
-                            image_name.endswith(".tga")
-                            )
-                        )
-                    break
-            if editor_image is not None:
+            image_name = VFS.resolve(
+                attributes["qer_editorimage"][0], image_formats)
+            if image_name is not None:
+                material_sizes[shader.lower()] = get_image_size(
+                    VFS, image_name, cache, new_sizes)
                 continue
 
-        for fmt in image_formats:
-            image_name = shader+fmt
-            image = VFS.get(image_name)
-            if image is not None:
-                material_sizes[shader.lower()] = (
-                    Image.get_image_dimensions_from_bytearray(
-                        image,
-                        image_name.endswith(".tga")
-                        )
-                    )
-                break
-        if image is not None:
+        image_name = VFS.resolve(shader, image_formats)
+        if image_name is not None:
+            material_sizes[shader.lower()] = get_image_size(
+                VFS, image_name, cache, new_sizes)
             continue
 
         for stage in stages:
             if "map" in stage:
-                for fmt in image_formats:
-                    image_name = stage["map"]+fmt
-                    image = VFS.get(image_name)
-                    if image is not None:
-                        material_sizes[shader.lower()] = (
-                            Image.get_image_dimensions_from_bytearray(
-                                image,
-                                image_name.endswith(".tga")
-                                )
-                            )
-                        break
-                if image is not None:
+                image_name = VFS.resolve(stage["map"], image_formats)
+                if image_name is not None:
+                    material_sizes[shader.lower()] = get_image_size(
+                        VFS, image_name, cache, new_sizes)
                     break
 
+    if new_sizes and VFS.cache_dir:
+        save_image_size_cache(VFS, new_sizes)
     return material_sizes
@@ -1,19 +1,264 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from hashlib import sha1
+import io
+import json
+import mmap
 import os
 import re
+import struct
+import tempfile
+import threading
+import time
 import zipfile
+import zlib
+
+# bump when the layout of the index cache files changes
+INDEX_CACHE_VERSION = 1
+
+# default directory for persisted vfs indexes, None disables them
+index_cache_dir = None
+
+# bytes of decompressed file contents kept around by Q3VFS.get, per
+# vfs instance, so this is multiplied by the number of open sessions
+DEFAULT_CONTENT_CACHE_BUDGET = 32 * 1024 * 1024
+content_cache_budget = DEFAULT_CONTENT_CACHE_BUDGET
+
+
+def set_index_cache_dir(path):
+    global index_cache_dir
+    index_cache_dir = path
+
+
+# budget for new vfs instances and the open sessions
+def set_content_cache_budget(budget):
+    global content_cache_budget
+    content_cache_budget = budget
+    for VFS in vfs_sessions.values():
+        VFS.set_content_cache_budget(budget)
+
+
+def map_file(path):
+    # read only memory map of a whole file, None for empty files
+    with open(path, 'rb') as fh:
+        try:
+            return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+
+
+# the parts of a zip entry that are needed to read it without
+# parsing the central directory again
+ZIP_INFO_ATTRIBUTES = ("header_offset", "compress_type", "flag_bits",
+                       "compress_size", "file_size", "CRC")
+
+
+def zip_info_to_list(info):
+    return [info.orig_filename] + [
+        getattr(info, attribute) for attribute in ZIP_INFO_ATTRIBUTES]
+
+
+def zip_info_from_list(values):
+    # ZipInfo keeps the raw name as orig_filename and normalises filename
+    # the same way reading the central directory does
+    info = zipfile.ZipInfo(values[0])
+    for attribute, value in zip(ZIP_INFO_ATTRIBUTES, values[1:]):
+        setattr(info, attribute, value)
+    return info
+
+
+class PK3Archive:
+    # opens the zip file only when something is read from it, so
+    # archives restored from the index cache cost nothing until used
+    # stored and deflated entries are read with a handle from a small
+    # pool, so several threads can inflate files at the same time
+    # handles beyond the pool size are closed again after reading
+    MAX_IDLE_HANDLES = 4
+
+    def __init__(self, filename, zip_file=None):
+        self.filename = filename
+        self.zip_file = zip_file
+        self.lock = threading.Lock()
+        self.idle_handles = []
+
+    def get_zip_file(self):
+        if self.zip_file is None:
+            self.zip_file = zipfile.ZipFile(self.filename, mode='r')
+        return self.zip_file
+
+    def acquire_handle(self):
+        with self.lock:
+            if self.idle_handles:
+                return self.idle_handles.pop()
+        return open(self.filename, 'rb')
+
+    def release_handle(self, handle):
+        with self.lock:
+            if len(self.idle_handles) < self.MAX_IDLE_HANDLES:
+                self.idle_handles.append(handle)
+                return
+        handle.close()
+
+    def get_data_offset(self, info, handle=None):
+        if handle is None:
+            handle = self.acquire_handle()
+            try:
+                return self.get_data_offset(info, handle)
+            finally:
+                self.release_handle(handle)
+        handle.seek(info.header_offset)
+        local_header = handle.read(30)
+        if len(local_header) < 30 or local_header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipFile(
+                "Bad local file header for " + info.filename)
+        name_length, extra_length = struct.unpack(
+            "<HH", local_header[26:30])
+        return info.header_offset + 30 + name_length + extra_length
+
+    def read(self, info):
+        if (info.flag_bits & 0x1 or info.compress_type not in (
+                zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)):
+            # encrypted or unusual compression, zipfile handles that
+            with self.lock:
+                return self.get_zip_file().read(info)
+        handle = self.acquire_handle()
+        try:
+            handle.seek(self.get_data_offset(info, handle))
+            data = handle.read(info.compress_size)
+        finally:
+            self.release_handle(handle)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -15)
+        if (len(data) != info.file_size or
+                zlib.crc32(data) != info.CRC):
+            raise zipfile.BadZipFile("Bad CRC-32 for " + info.filename)
+        return data
+
+    def close(self):
+        with self.lock:
+            if self.zip_file is not None:
+                self.zip_file.close()
+                self.zip_file = None
+            for handle in self.idle_handles:
+                handle.close()
+            self.idle_handles = []
+
+
+class PK3EntryFile(io.RawIOBase):
+    # seekable read only view of one pk3 entry, deflated entries are
+    # inflated in chunks only as far as they are read
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, filename, info, data_offset):
+        super().__init__()
+        self.handle = open(filename, 'rb')
+        self.info = info
+        self.data_offset = data_offset
+        self.position = 0
+        self.reset_stream()
+
+    def reset_stream(self):
+        self.decompressor = zlib.decompressobj(-15)
+        self.compressed_read = 0
+        self.buffer = b""
+        self.buffer_start = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.info.file_size
+        if offset < 0:
+            raise ValueError("negative seek position " + str(offset))
+        self.position = offset
+        return self.position
+
+    def inflate(self):
+        remaining = self.info.compress_size - self.compressed_read
+        if remaining <= 0:
+            return False
+        self.handle.seek(self.data_offset + self.compressed_read)
+        chunk = self.handle.read(min(self.CHUNK_SIZE, remaining))
+        if not chunk:
+            return False
+        self.compressed_read += len(chunk)
+        self.buffer_start += len(self.buffer)
+        self.buffer = self.decompressor.decompress(chunk)
+        return True
+
+    def read(self, size=-1):
+        available = max(0, self.info.file_size - self.position)
+        if size is None or size < 0 or size > available:
+            size = available
+        if self.info.compress_type == zipfile.ZIP_STORED:
+            self.handle.seek(self.data_offset + self.position)
+            data = self.handle.read(size)
+            self.position += len(data)
+            return data
+        # going backwards means inflating from the start again
+        if self.position < self.buffer_start:
+            self.reset_stream()
+        data = bytearray()
+        while len(data) < size:
+            offset = self.position - self.buffer_start
+            if offset < len(self.buffer):
+                part = self.buffer[offset:offset + size - len(data)]
+                data += part
+                self.position += len(part)
+            elif not self.inflate():
+                break
+        return bytes(data)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.handle.close()
+        super().close()
 
 
 class Q3VFS:
 
+    class Directory:
+        def __init__(self):
+            self.dirs = {}
+            self.files = []
+
     class LooseFileRetriever:
         def __init__(self, path):
             self.path = path
 
         def get(self):
-            fh = open(self.path, 'rb')
-            data = bytearray(fh.read())
-            fh.close()
-            return data
+            with open(self.path, 'rb') as fh:
+                return fh.read()
+
+        def get_buffer(self):
+            mapped = map_file(self.path)
+            if mapped is None:
+                return self.get()
+            return mapped
+
+        def stamp(self):
+            stat = os.stat(self.path)
+            return (self.path, stat.st_mtime_ns, stat.st_size)
+
+        def open(self):
+            return open(self.path, 'rb')
+
+        def source(self):
+            return self.path
 
     class PK3FileRetriever:
         def __init__(self, pk3, path):
@@ -23,10 +268,66 @@ class Q3VFS:
         def get(self):
             return self.pk3.read(self.path)
 
-    def __init__(self):
+        def get_buffer(self):
+            # only uncompressed entries can be mapped, everything else
+            # needs to be inflated anyway
+            if (self.path.compress_type != zipfile.ZIP_STORED or
+                    self.path.flag_bits & 0x1 or
+                    self.path.file_size == 0):
+                return self.get()
+            try:
+                data_offset = self.pk3.get_data_offset(self.path)
+            except zipfile.BadZipFile:
+                return self.get()
+            mapped = map_file(self.pk3.filename)
+            if mapped is None:
+                return self.get()
+            return memoryview(mapped)[
+                data_offset:data_offset + self.path.file_size]
+
+        def stamp(self):
+            return (self.pk3.filename, self.path.CRC, self.path.file_size)
+
+        def source(self):
+            return self.pk3.filename
+
+        def open(self):
+            if (self.path.flag_bits & 0x1 or self.path.compress_type not in (
+                    zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)):
+                return io.BytesIO(self.get())
+            return PK3EntryFile(self.pk3.filename,
+                                self.path,
+                                self.pk3.get_data_offset(self.path))
+
+    def __init__(self, cache_dir=None):
         self.basepaths = []
         self.index = {}
-        pass
+        self.archives = []
+        # directory tree and extension index over the index keys,
+        # built on first use
+        self.tree = None
+        self.extensions = None
+        self.index_order = None
+        if cache_dir is None:
+            cache_dir = index_cache_dir
+        self.cache_dir = cache_dir
+        # threads reading pk3 directories, None picks a default
+        self.index_workers = None
+        # least recently used file contents, path -> (stamp, data)
+        self.content_cache = OrderedDict()
+        self.content_cache_size = 0
+        self.content_cache_budget = content_cache_budget
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.lock = threading.RLock()
+        # (stem, extensions) -> resolved path or None for misses
+        self.resolve_cache = {}
+        # list of access records while tracing, None when disabled
+        self.trace = None
+        # stamps of the last index build, used to find out if the index
+        # is outdated, pk3 path -> [mtime, size]
+        self.pk3_stamps = None
+        self.index_stamps = None
 
     # add in order of preference, higher -> lower
     def add_base(self, path):
@@ -35,37 +336,611 @@ class Q3VFS:
                 'base path "{}" does not seem to exist'.format(path))
         self.basepaths.append(path)
 
+    def get_index_cache_path(self):
+        if not self.cache_dir:
+            return None
+        key = sha1(repr(self.basepaths).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, "vfs_index_" + key + ".json")
+
+    def load_index_cache(self):
+        cache = {"version": INDEX_CACHE_VERSION, "pk3s": {}, "dirs": {}}
+        cache_path = self.get_index_cache_path()
+        if cache_path is None or not os.path.isfile(cache_path):
+            return cache
+        try:
+            with open(cache_path, "r") as file:
+                cached = json.load(file)
+            if cached.get("version") == INDEX_CACHE_VERSION:
+                cache = cached
+        except Exception as e:
+            print("Could not load vfs index cache", cache_path, e)
+        return cache
+
+    def save_index_cache(self, cache):
+        cache_path = self.get_index_cache_path()
+        if cache_path is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            file_handle, temp_path = tempfile.mkstemp(
+                suffix=".tmp", dir=self.cache_dir)
+            with os.fdopen(file_handle, "w") as file:
+                json.dump(cache, file)
+            os.replace(temp_path, cache_path)
+        except Exception as e:
+            print("Could not write vfs index cache", cache_path, e)
+
+    @staticmethod
+    def read_pk3(pk3_path, cached_pk3s):
+        # returns the archive, its entries and the cache entry for it,
+        # the central directory is only read when the file changed
+        stat = os.stat(pk3_path)
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        cached = cached_pk3s.get(pk3_path)
+        if cached is not None and cached["stamp"] == stamp:
+            infos = [zip_info_from_list(values)
+                     for values in cached["entries"]]
+            return PK3Archive(pk3_path), infos, cached
+        pk3h = zipfile.ZipFile(pk3_path, mode='r')
+        infos = [f for f in pk3h.infolist() if not f.is_dir()]
+        cached = {"stamp": stamp,
+                  "entries": [zip_info_to_list(info) for info in infos]}
+        return PK3Archive(pk3_path, pk3h), infos, cached
+
+    @staticmethod
+    def walk(path, cached_dirs, new_dirs):
+        # same order as os.walk, but directories that did not change
+        # since the last index build are not listed again
+        try:
+            stamp = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        cached = cached_dirs.get(path)
+        if cached is None or cached["stamp"] != stamp:
+            files = []
+            dirs = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if not entry.is_dir():
+                            files.append(entry.name)
+                        elif not entry.is_symlink():
+                            dirs.append(entry.name)
+            except OSError:
+                return
+            cached = {"stamp": stamp, "files": files, "dirs": dirs}
+        new_dirs[path] = cached
+        yield path, cached["files"]
+        for directory in cached["dirs"]:
+            yield from Q3VFS.walk(
+                os.path.join(path, directory), cached_dirs, new_dirs)
+
+    @staticmethod
+    def get_pk3_stamp(pk3_path):
+        try:
+            stat = os.stat(pk3_path)
+            return [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            return None
+
     def build_index(self):
+        cache = self.load_index_cache()
+        if (self.index_stamps is not None and
+                self.get_index_cache_path() is None):
+            # no index cache on disk, the stamps of the last build still
+            # spare reading unchanged archives again
+            cache = self.index_stamps
+        new_cache = {"version": INDEX_CACHE_VERSION, "pk3s": {}, "dirs": {}}
+        bases = []
+        pk3_stamps = {}
+        for base in reversed(self.basepaths):
+            pk3_files = sorted(
+                [f for f in os.listdir(base) if f.endswith('.pk3')])
+            bases.append((base, pk3_files))
+            for pk3_file in pk3_files:
+                pk3_path = os.path.join(base, pk3_file)
+                pk3_stamps[pk3_path] = self.get_pk3_stamp(pk3_path)
+
+        def read_pk3(pk3_path):
+            try:
+                return self.read_pk3(pk3_path, cache["pk3s"])
+            except Exception:
+                return None
+
+        # central directories are read in parallel, the results come back
+        # in submission order so the override order stays the same
+        with ThreadPoolExecutor(max_workers=self.index_workers) as executor:
+            pk3_results = executor.map(
+                read_pk3,
+                [os.path.join(base, pk3_file)
+                 for base, pk3_files in bases for pk3_file in pk3_files])
+            self.merge_index(bases, pk3_results, cache, new_cache)
+        self.tree = None
+        self.clear_resolve_cache()
+        self.pk3_stamps = pk3_stamps
+        self.index_stamps = new_cache
+        if new_cache != cache:
+            self.save_index_cache(new_cache)
+
+    # true when a pk3 or a directory in the base paths changed since
+    # the index was built, edits of loose files are caught by the stamps
+    # of the content cache instead
+    def is_outdated(self):
+        if self.index_stamps is None:
+            return True
+        pk3_paths = []
         for base in reversed(self.basepaths):
-            for pk3_file in sorted(
-                    [f for f in os.listdir(base) if f.endswith('.pk3')]):
-                try:
-                    pk3h = zipfile.ZipFile(os.path.join(base, pk3_file), mode='r')
-                except Exception:
+            try:
+                pk3_files = sorted(
+                    [f for f in os.listdir(base) if f.endswith('.pk3')])
+            except OSError:
+                return True
+            pk3_paths += [os.path.join(base, f) for f in pk3_files]
+        if pk3_paths != list(self.pk3_stamps):
+            return True
+        for pk3_path, stamp in self.pk3_stamps.items():
+            if self.get_pk3_stamp(pk3_path) != stamp:
+                return True
+        for path, cached in self.index_stamps["dirs"].items():
+            try:
+                if os.stat(path).st_mtime_ns != cached["stamp"]:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    # builds the index again, only changed archives and directories are
+    # read, archives of the old index are closed
+    def rebuild_index(self):
+        with self.lock:
+            archives = self.archives
+            self.index = {}
+            self.archives = []
+            self.build_index()
+            # remembered misses might exist now
+            self.clear_resolve_cache()
+        for archive in archives:
+            archive.close()
+
+    def merge_index(self, bases, pk3_results, cache, new_cache):
+        for base, pk3_files in bases:
+            for pk3_file in pk3_files:
+                pk3_path = os.path.join(base, pk3_file)
+                result = next(pk3_results)
+                if result is None:
                     print('"{}" in "{}" is not a valid pk3 file'.format(pk3_file, base))
                     continue
-                for pk3f in [f for f in pk3h.infolist() if not f.is_dir()]:
+                pk3h, infos, cached = result
+                new_cache["pk3s"][pk3_path] = cached
+                self.archives.append(pk3h)
+                for pk3f in infos:
                     self.index[pk3f.filename.lower()] = self.PK3FileRetriever(
                         pk3h, pk3f)
-            for root, dirs, files in os.walk(base):
+            for root, files in self.walk(base, cache["dirs"], new_cache["dirs"]):
                 for f in files:
                     abspath = os.path.join(root, f)
                     relpath = str(abspath[len(base):]).replace("\\", "/")
                     self.index[relpath.lower()] = self.LooseFileRetriever(abspath)
 
-    def get(self, path):
+    def close(self):
+        for archive in self.archives:
+            archive.close()
+        self.clear_content_cache()
+
+    def set_content_cache_budget(self, budget):
+        with self.lock:
+            self.content_cache_budget = budget
+            self.trim_content_cache()
+
+    def clear_content_cache(self):
+        with self.lock:
+            self.content_cache.clear()
+            self.content_cache_size = 0
+
+    def trim_content_cache(self):
+        while self.content_cache_size > self.content_cache_budget:
+            stamp, data = self.content_cache.popitem(last=False)[1]
+            self.content_cache_size -= len(data)
+
+    def get_cache_stats(self) -> dict:
+        return {"hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "entries": len(self.content_cache),
+                "bytes": self.content_cache_size,
+                "budget": self.content_cache_budget}
+
+    def get_cached(self, path_low, cache=True):
+        # the stamp makes sure edited loose files are read again
+        # reading happens outside of the lock so threads can decompress
+        # files in parallel
+        retriever = self.index[path_low]
+        try:
+            stamp = retriever.stamp()
+        except OSError:
+            # deleted or unreadable since the index was built
+            if self.trace is not None:
+                self.record("get", path_low, "missing")
+            return None
+        with self.lock:
+            cached = self.content_cache.get(path_low)
+            if cached is not None and cached[0] == stamp:
+                self.cache_hits += 1
+                self.content_cache.move_to_end(path_low)
+                if self.trace is not None:
+                    self.record("get", path_low, "hit", len(cached[1]),
+                                0.0, retriever.source())
+                return cached[1]
+            self.cache_misses += 1
+        start = time.perf_counter()
+        try:
+            data = bytes(retriever.get())
+        except (OSError, zipfile.BadZipFile, zlib.error):
+            if self.trace is not None:
+                self.record("get", path_low, "missing")
+            return None
+        if self.trace is not None:
+            self.record("get", path_low, "miss", len(data),
+                        time.perf_counter() - start, retriever.source())
+        with self.lock:
+            cached = self.content_cache.pop(path_low, None)
+            if cached is not None:
+                self.content_cache_size -= len(cached[1])
+            if cache and len(data) <= self.content_cache_budget:
+                self.content_cache[path_low] = (stamp, data)
+                self.content_cache_size += len(data)
+                self.trim_content_cache()
+        return data
+
+    # reads files with a pool of threads, returns path -> contents
+    def prefetch(self, paths, workers=None):
+        paths = list(paths)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(paths, executor.map(self.get, paths)))
+
+    # returns the file contents as read only bytes object, files that
+    # are copied somewhere else right away don't need to be cached
+    def get(self, path, cache=True):
         path_low = path.lower()
         if path_low in self.index:
-            return self.index[path_low].get()
+            return self.get_cached(path_low, cache)
         else:
             try:
-                fh = open(path, 'rb')
-                data = bytearray(fh.read())
-                fh.close()
+                with open(path, 'rb') as fh:
+                    data = fh.read()
+                if self.trace is not None:
+                    self.record("get", path, "disk", len(data), 0.0, path)
                 return data
             except Exception:
+                if self.trace is not None:
+                    self.record("get", path, "missing")
                 return None
 
+    def clear_resolve_cache(self):
+        with self.lock:
+            self.resolve_cache = {}
+
+    # first of stem + extension that exists, in order of the extensions,
+    # lookups are remembered so missing assets only cost one dict access
+    def resolve(self, stem, extensions=("",)):
+        key = (stem.lower(), tuple(extensions))
+        with self.lock:
+            if key in self.resolve_cache:
+                return self.resolve_cache[key]
+        resolved = None
+        for extension in extensions:
+            path_low = key[0] + extension.lower()
+            if path_low in self.index:
+                resolved = path_low
+                break
+        if resolved is None and os.path.isabs(stem):
+            # files outside of the base paths are not cached, they
+            # might get created at any time
+            for extension in extensions:
+                if os.path.isfile(stem + extension):
+                    return stem + extension
+            resolved = None
+        else:
+            with self.lock:
+                self.resolve_cache[key] = resolved
+        if resolved is None and self.trace is not None:
+            self.record("resolve", stem, "missing")
+        return resolved
+
+    # path on disk for loose files, None for files in pk3s
+    def get_local_path(self, path):
+        retriever = self.index.get(path.lower())
+        if retriever is None:
+            if os.path.isfile(path):
+                return path
+            return None
+        if isinstance(retriever, self.LooseFileRetriever):
+            return retriever.path
+        return None
+
+    # seekable binary file object, only the parts that are read get
+    # decompressed, raises FileNotFoundError for missing files
+    def open(self, path):
+        path_low = path.lower()
+        if path_low in self.index:
+            data = self.get_cached_data(path_low)
+            if data is not None:
+                return io.BytesIO(data)
+            return self.index[path_low].open()
+        return open(path, 'rb')
+
+    # size bytes starting at offset, less at the end of the file and
+    # None if the file can not be read
+    def read_range(self, path, offset, size):
+        path_low = path.lower()
+        if path_low in self.index:
+            data = self.get_cached_data(path_low)
+            if data is not None:
+                return data[offset:offset + size]
+        try:
+            with self.open(path) as file:
+                file.seek(offset)
+                return file.read(size)
+        except Exception:
+            return None
+
+    # contents from the cache without reading the file, None if they
+    # are not cached or outdated
+    def get_cached_data(self, path_low):
+        try:
+            stamp = self.index[path_low].stamp()
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.content_cache.get(path_low)
+        if cached is None or cached[0] != stamp:
+            return None
+        return cached[1]
+
+    # like get, but maps the file instead of copying it when possible
+    # the returned buffer is read only
+    def get_buffer(self, path):
+        path_low = path.lower()
+        if path_low in self.index:
+            retriever = self.index[path_low]
+            start = time.perf_counter()
+            buffer = retriever.get_buffer()
+            if self.trace is not None:
+                self.record("get_buffer", path_low, "miss", len(buffer),
+                            time.perf_counter() - start, retriever.source())
+            return buffer
+        try:
+            mapped = map_file(path)
+            if mapped is None:
+                return self.get(path)
+            return mapped
+        except Exception:
+            if self.trace is not None:
+                self.record("get_buffer", path, "missing")
+            return None
+
+    # identifies the current version of a file without reading it,
+    # None if the file does not exist
+    def get_stamp(self, path):
+        path_low = path.lower()
+        try:
+            if path_low in self.index:
+                return self.index[path_low].stamp()
+            stat = os.stat(path)
+            return (path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
     def search(self, reg):
+        start = time.perf_counter()
         searcher = re.compile(reg)
-        return [k for k in self.index if searcher.search(k)]
+        results = [k for k in self.index if searcher.search(k)]
+        if self.trace is not None:
+            self.record("search", reg, "hit" if results else "missing",
+                        len(results), time.perf_counter() - start)
+        return results
+
+    # opt in access tracing, every get, search and failed resolve is
+    # recorded until stop_trace is called
+    def start_trace(self):
+        with self.lock:
+            self.trace = []
+
+    def stop_trace(self):
+        with self.lock:
+            trace = self.trace
+            self.trace = None
+        return trace
+
+    def record(self, operation, path, status, size=0, duration=0.0,
+               source=None):
+        with self.lock:
+            if self.trace is not None:
+                self.trace.append({"op": operation,
+                                   "path": path,
+                                   "status": status,
+                                   "bytes": size,
+                                   "time": duration,
+                                   "source": source})
+
+    def get_trace_summary(self, trace=None, top=20) -> dict:
+        if trace is None:
+            trace = self.trace or []
+        files = {}
+        missing = []
+        for entry in trace:
+            if entry["status"] == "missing":
+                if entry["path"] not in missing:
+                    missing.append(entry["path"])
+                continue
+            if entry["op"] not in ("get", "get_buffer"):
+                continue
+            if entry["path"] not in files:
+                files[entry["path"]] = {"path": entry["path"],
+                                        "source": entry["source"],
+                                        "reads": 0,
+                                        "hits": 0,
+                                        "bytes": 0,
+                                        "time": 0.0}
+            stats = files[entry["path"]]
+            stats["reads"] += 1
+            stats["bytes"] += entry["bytes"]
+            stats["time"] += entry["time"]
+            if entry["status"] == "hit":
+                stats["hits"] += 1
+        by_bytes = sorted(files.values(), key=lambda f: -f["bytes"])
+        return {
+            "gets": sum(f["reads"] for f in files.values()),
+            "cache_hits": sum(f["hits"] for f in files.values()),
+            "bytes": sum(f["bytes"] for f in files.values()),
+            "read_bytes": sum(e["bytes"] for e in trace
+                              if e["op"] in ("get", "get_buffer") and
+                              e["status"] != "hit"),
+            "read_time": sum(e["time"] for e in trace
+                             if e["op"] in ("get", "get_buffer")),
+            "searches": sum(1 for e in trace if e["op"] == "search"),
+            "search_time": sum(e["time"] for e in trace
+                               if e["op"] == "search"),
+            "top_files": by_bytes[:top],
+            "repeated_reads": [f["path"] for f in by_bytes
+                               if f["reads"] - f["hits"] > 1],
+            "missing": missing,
+        }
+
+    def print_trace_summary(self, trace=None, top=20):
+        summary = self.get_trace_summary(trace, top)
+        print("VFS: {} gets ({} cache hits), {:.2f} MiB returned, "
+              "{:.2f} MiB read in {:.3f}s, {} searches in {:.3f}s".format(
+                  summary["gets"], summary["cache_hits"],
+                  summary["bytes"] / 1048576.0,
+                  summary["read_bytes"] / 1048576.0,
+                  summary["read_time"], summary["searches"],
+                  summary["search_time"]))
+        for stats in summary["top_files"]:
+            print("  {:>10} bytes {:>4} reads {:.3f}s {} ({})".format(
+                stats["bytes"], stats["reads"], stats["time"],
+                stats["path"], stats["source"]))
+        for path in summary["missing"]:
+            print("  missing:", path)
+
+    def write_trace(self, file_path, trace=None):
+        if trace is None:
+            trace = self.trace or []
+        with open(file_path, "w") as file:
+            json.dump({"summary": self.get_trace_summary(trace),
+                       "trace": trace}, file, indent=1)
+
+    def build_tree(self):
+        self.tree = self.Directory()
+        self.extensions = {}
+        self.index_order = {}
+        for position, key in enumerate(self.index):
+            self.index_order[key] = position
+            node = self.tree
+            for part in key.strip("/").split("/")[:-1]:
+                if part not in node.dirs:
+                    node.dirs[part] = self.Directory()
+                node = node.dirs[part]
+            node.files.append(key)
+            extension = os.path.splitext(key)[1]
+            if extension not in self.extensions:
+                self.extensions[extension] = []
+            self.extensions[extension].append(key)
+
+    # files in a directory, optionally filtered by extension(s),
+    # in the same order search would return them
+    def list_dir(self, prefix="", ext=None, recursive=False):
+        with self.lock:
+            if self.tree is None:
+                self.build_tree()
+        if isinstance(ext, str):
+            ext = (ext,)
+        if ext is not None:
+            ext = tuple(
+                e.lower() if e.startswith(".") else "." + e.lower()
+                for e in ext)
+
+        prefix = prefix.lower().replace("\\", "/").strip("/")
+        if prefix == "" and recursive and ext is not None:
+            files = []
+            for extension in ext:
+                files += self.extensions.get(extension, [])
+            if len(ext) > 1:
+                files.sort(key=self.index_order.get)
+            return files
+
+        node = self.tree
+        for part in prefix.split("/"):
+            if part == "":
+                continue
+            node = node.dirs.get(part)
+            if node is None:
+                return []
+        files = list(node.files)
+        if recursive:
+            nodes = list(node.dirs.values())
+            while nodes:
+                node = nodes.pop()
+                files += node.files
+                nodes += node.dirs.values()
+            files.sort(key=self.index_order.get)
+        if ext is not None:
+            files = [f for f in files if f.endswith(ext)]
+        return files
+
+    def glob(self, pattern):
+        # only the directories before the first wildcard are looked up,
+        # everything below them is matched per path segment with fnmatch
+        parts = pattern.lower().replace("\\", "/").strip("/").split("/")
+        fixed = []
+        for part in parts[:-1]:
+            if any(c in part for c in "*?["):
+                break
+            fixed.append(part)
+        recursive = len(fixed) < len(parts) - 1
+        files = []
+        for f in self.list_dir("/".join(fixed), recursive=recursive):
+            file_parts = f.strip("/").split("/")
+            if len(file_parts) == len(parts) and all(
+                    fnmatchcase(file_part, part)
+                    for file_part, part in zip(file_parts, parts)):
+                files.append(f)
+        return files
+
+
+# vfs instances shared by everything that uses the same base paths,
+# keyed by the ordered base path list, least recently used first
+vfs_sessions = OrderedDict()
+
+# sessions kept open, every session holds archive handles and a
+# content cache
+MAX_VFS_SESSIONS = 4
+
+
+def get_vfs_session(base_paths):
+    key = tuple(base_paths)
+    VFS = vfs_sessions.pop(key, None)
+    if VFS is None:
+        VFS = Q3VFS()
+        for base_path in base_paths:
+            VFS.add_base(base_path)
+        VFS.build_index()
+    elif VFS.is_outdated():
+        # pk3s or loose files were added, removed or replaced on disk
+        VFS.rebuild_index()
+    vfs_sessions[key] = VFS
+    while len(vfs_sessions) > MAX_VFS_SESSIONS:
+        vfs_sessions.popitem(last=False)[1].close()
+    return VFS
+
+
+# drops the sessions so the next request builds a new index, all
+# sessions when no base paths are given
+def invalidate_vfs_sessions(base_paths=None):
+    if base_paths is None:
+        keys = list(vfs_sessions)
+    else:
+        keys = [tuple(base_paths)]
+    for key in keys:
+        VFS = vfs_sessions.pop(key, None)
+        if VFS is not None:
+            VFS.close()
@@ -76,6 +76,10 @@ class Import_Settings:
     current_vert_pack_index = 0
     normal_map_option: NormalMapOption = NormalMapOption.DIRECTX
     surface_info_storing: Surface_info_storing = Surface_info_storing.NONE
+    # decoded lumps and lightmap info get cached here when set
+    bsp_cache_dir: str = ""
+    # json trace of all vfs accesses of the import is written here when set
+    vfs_trace_file: str = ""
 
     def __post_init__(self):
         self.bsp_name = guess_map_name(self.file)
@@ -218,6 +218,8 @@ class BSP_INFO:
 
     lightmap_lumps = ("lightmaps",)
 
+    blob_lumps = ("entities", "visdata")
+
     @classmethod
     def lerp_vertices(
             cls,
@@ -0,0 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor
+import importlib.util
+import multiprocessing
+import os
+import site
+import sys
+
+# the add-on package imports bpy, which spawned worker processes don't
+# have, so workers import this library as a top level package from the
+# add-on folder instead
+LIBRARY_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(LIBRARY_DIR)
+LIBRARY_NAME = os.path.basename(LIBRARY_DIR)
+
+
+def import_library():
+    # loads the top level package from its folder without putting the
+    # add-on folder on the host's sys.path
+    if LIBRARY_NAME in sys.modules:
+        return sys.modules[LIBRARY_NAME]
+    spec = importlib.util.spec_from_file_location(
+        LIBRARY_NAME,
+        os.path.join(LIBRARY_DIR, "__init__.py"),
+        submodule_search_locations=[LIBRARY_DIR])
+    library = importlib.util.module_from_spec(spec)
+    sys.modules[LIBRARY_NAME] = library
+    try:
+        spec.loader.exec_module(library)
+    except BaseException:
+        del sys.modules[LIBRARY_NAME]
+        raise
+    return library
+
+
+# returns the same function from a module that workers can import
+def worker_function(function):
+    module_name = (LIBRARY_NAME + "." +
+                   function.__module__.rpartition(".")[2])
+    if function.__module__ != module_name:
+        import_library()
+        function = getattr(importlib.import_module(module_name),
+                           function.__qualname__)
+    return function
+
+
+def create_pool(workers):
+    # spawn instead of forking the host application, workers find the
+    # library through the add-on folder before any call is unpickled
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=site.addsitedir,
+        initargs=(ADDON_DIR,))
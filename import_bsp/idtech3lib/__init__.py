@@ -33,10 +33,14 @@ if "MAP" in locals():
     importlib.reload(MAP)
 if "BSP" in locals():
     importlib.reload(BSP)
+if "BSPIndex" in locals():
+    importlib.reload(BSPIndex)
+if "Workers" in locals():
+    importlib.reload(Workers)
 
-from . import BSP, EF2BSP, FAKK, FBSP, IBSP, RBSP, MAP
+from . import BSP, BSPIndex, EF2BSP, FAKK, FBSP, IBSP, RBSP, MAP
 from . import GamePacks, Helpers, ID3Brushes, ID3Image
 from . import ID3Model, ID3Object, ID3Shader, ID3VFS
-from . import ImportSettings, Parsing
+from . import ImportSettings, Parsing, Workers
 
 